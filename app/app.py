@@ -1,34 +1,138 @@
+import io
 import os
 import pathlib
+import tempfile
+import time
+import zipfile
 
 import dash
+import flask
 import plotly.graph_objs as go
 import dash_daq as daq
 from dash.exceptions import PreventUpdate
-from dash import ALL, dash_table, html, dcc, MATCH, Output, Input, State
+from dash import ALL, ClientsideFunction, dash_table, html, dcc, MATCH, Output, Input, State
 import numpy as np
 import pandas as pd
 import boto3
 
+try:
+    import flask_compress  # noqa: F401
+except ImportError:
+    flask_compress = None
+
+from callback_metrics import CallbackMetrics
+from control_stats import RunningStats
+from downsample import lttb
+from live_feed import FileSource, KinesisSource, LiveFeed, LivePriceStore
+from portfolio_history import PortfolioHistoryStore
+from price_store import SESSION_ID_RE, PriceStore, new_session_id
+import session_archive
+from tick_store import TickStore
+from valuation import ValuationEngine
+
 app = dash.Dash(
     __name__,
-    meta_tags=[{"name": "viewport", "content": "width=device-width, initial-scale=1"}]
+    meta_tags=[{"name": "viewport", "content": "width=device-width, initial-scale=1"}],
+    # Gzip responses when flask-compress is installed; the playback
+    # columns of PLAYBACK_MODE=client ship in the layout
+    compress=flask_compress is not None,
 )
 app.title = "Crypto Trading Dashboard"
 server = app.server
 app.config["suppress_callback_exceptions"] = True
+# Prometheus text on /metrics, summed over all gunicorn workers
+callback_metrics = CallbackMetrics(app, directory=os.environ.get("METRICS_DIR"))
 
 APP_PATH = str(pathlib.Path(__file__).parent.resolve())
-df = pd.read_csv(os.path.join(APP_PATH, os.path.join("data", "final_data.csv")))
+# Memory-mapped columns written by convert_data.py, CSV if not converted yet
+price_store = PriceStore.load(
+    os.path.join(APP_PATH, os.path.join("data", "final_data")),
+    csv_path=os.path.join(APP_PATH, os.path.join("data", "final_data.csv")),
+)
+
+# REPLAY_ARCHIVE replays a session exported to Parquet instead, reading only
+# REPLAY_PRODUCTS (comma separated) between REPLAY_START and REPLAY_STOP
+if os.environ.get("REPLAY_ARCHIVE"):
+    replay_products = os.environ.get("REPLAY_PRODUCTS")
+    price_store = session_archive.load_price_store(
+        os.environ["REPLAY_ARCHIVE"],
+        products=replay_products.split(",") if replay_products else None,
+        start=os.environ.get("REPLAY_START"),
+        stop=os.environ.get("REPLAY_STOP"),
+    )
+
+# "replay" plays final_data.csv back, "kinesis" and "file" follow the same
+# currencies live from the stream the Coinbase lambda writes to (or from a
+# file of its messages)
+data_source = os.environ.get("DATA_SOURCE", "replay")
+
+# With TICK_STORE_DIR set, every live ticker is kept on disk and can be
+# read back by time range on /ticks/<product>; one worker writes
+tick_store = None
+if os.environ.get("TICK_STORE_DIR"):
+    tick_store = TickStore(os.environ["TICK_STORE_DIR"], writable=data_source != "replay")
+
+
+def ticks_view(product_id):
+    args = flask.request.args
+    try:
+        stop = float(args.get("stop", time.time()))
+        start = float(args.get("start", stop - 3600))
+    except ValueError:
+        flask.abort(400, "start and stop must be epoch seconds")
+    if not (np.isfinite(start) and np.isfinite(stop)):
+        flask.abort(400, "start and stop must be epoch seconds")
+    ticks = tick_store.read(product_id, start, stop)
+    # JSON has no NaN, missing bids and asks become null
+    return flask.jsonify({
+        name: [None if np.isnan(v) else v for v in values.tolist()]
+        for name, values in ticks.items()
+    })
+
+
+if tick_store is not None:
+    server.add_url_rule("/ticks/<product_id>", "ticks", ticks_view)
+
+if data_source != "replay":
+    if data_source == "kinesis":
+        ticker_source = KinesisSource(os.environ.get("KINESIS_STREAM", "dev-coinbase-stream"))
+    elif data_source == "file":
+        ticker_source = FileSource(os.environ["LIVE_FEED_FILE"], loop=True)
+    else:
+        raise ValueError("Unknown DATA_SOURCE: {}".format(data_source))
+    live_feed = LiveFeed(ticker_source, price_store.params[1:], tick_store=tick_store)
+    live_feed.start()
+    price_store = LivePriceStore(live_feed, batch_name=price_store.params[0])
+
+valuation = ValuationEngine(price_store)
+
+# "client" ships the price columns to the browser once and plays the metric
+# rows back with clientside callbacks, "server" looks each tick up here
+playback_mode = os.environ.get("PLAYBACK_MODE", "server") if data_source == "replay" else "server"
+playback_payload = price_store.playback_payload() if playback_mode == "client" else None
 
-params = list(df)
+params = price_store.params
 # print(params)
-max_length = len(df)
-# print(max_length)
+
+# Number of recent portfolio values the control limits are computed over,
+# 0 uses the whole session
+control_chart_window = int(os.environ.get("CONTROL_CHART_WINDOW", 0))
+
+# Per-session portfolio history lives on the server; the browser only
+# ever holds the newest value
+portfolio_history = PortfolioHistoryStore(
+    directory=os.environ.get("PORTFOLIO_HISTORY_DIR"),
+    capacity=max(int(os.environ.get("PORTFOLIO_HISTORY_CAPACITY", 1000)), control_chart_window + 1),
+)
 
 suffix_row = "_row"
 suffix_button_id = "_button"
 suffix_sparkline_graph = "_sparkline_graph"
+# Most points sent to the browser per trace: sparklines are served from
+# rollups at about this resolution, and every trace is then cut to its
+# budget with LTTB
+sparkline_points = int(os.environ.get("SPARKLINE_POINTS", 100))
+chart_max_points = int(os.environ.get("CHART_MAX_POINTS", 500))
 suffix_count = "_count"
 suffix_ooc_n = "_OOC_number"
 suffix_ooc_g = "_OOC_graph"
@@ -56,6 +160,12 @@ def build_banner():
                     html.Button(
                         id="settings-button", children="SETTINGS", n_clicks=0
                     ),
+                ] + ([
+                    # Parquet export needs pyarrow
+                    html.Button(
+                        id="export-button", children="EXPORT", n_clicks=0
+                    ),
+                ] if session_archive.available() else []) + [
                     html.A(
                         html.Img(id="logo", src=app.get_asset_url("dash-logo-new.png")),
                         href="https://plotly.com/dash/",
@@ -96,38 +206,6 @@ def build_banner():
 #     )
 
 
-def init_df():
-    ret = {}
-    for col in list(df[1:]):
-        data = df[col]
-        # stats = data.describe()
-        #
-        # std = stats["std"].tolist()
-        # ucl = (stats["mean"] + 3 * stats["std"]).tolist()
-        # lcl = (stats["mean"] - 3 * stats["std"]).tolist()
-        # usl = (stats["mean"] + stats["std"]).tolist()
-        # lsl = (stats["mean"] - stats["std"]).tolist()
-
-        ret.update(
-            {
-                col: {
-                    "data": data,
-                    # "mean": stats["mean"].tolist(),
-                    # "std": std,
-                    # "ucl": round(ucl, 3),
-                    # "lcl": round(lcl, 3),
-                    # "usl": round(usl, 3),
-                    # "lsl": round(lsl, 3),
-                    # "min": stats["min"].tolist(),
-                    # "max": stats["max"].tolist(),
-                    # "ooc": populate_ooc(data, ucl, lcl),
-                }
-            }
-        )
-
-    return ret
-
-
 def populate_ooc(data, ucl, lcl):
     ooc_count = 0
     ret = []
@@ -140,13 +218,16 @@ def populate_ooc(data, ucl, lcl):
     return ret
 
 
-state_dict = init_df()
+def check_session_id(session_id):
+    # A missing key means the layout has not been served to this client yet
+    if session_id is None or not SESSION_ID_RE.match(session_id):
+        raise PreventUpdate
 
 
-def init_value_setter_store():
-    # Initialize store data
-    state_dict = init_df()
-    return state_dict
+def get_price_store(session_id):
+    # Every session replays the same history
+    check_session_id(session_id)
+    return price_store
 
 
 def init_owned_currencies_store():
@@ -329,10 +410,10 @@ def generate_modal():
 def build_quick_stats_panel(initial_portfolio_value, portfolio_value):
     initial_portfolio_value_str = str(initial_portfolio_value) + "$"
 
-    if len(portfolio_value) == 0:
+    if portfolio_value is None:
         portfolio_value_str = "--"
     else:
-        portfolio_value_str = str(portfolio_value[-1]) + "$"
+        portfolio_value_str = str(round(portfolio_value, 2)) + "$"
 
     return html.Div(
         id="quick-stats",
@@ -464,14 +545,18 @@ def generate_metric_row_helper(stopped_interval, index):
 
     div_id = item + suffix_row
     button_id = item + suffix_button_id
-    sparkline_graph_id = item + suffix_sparkline_graph
-    count_id = item + suffix_count
-    ooc_percentage_id = item + suffix_ooc_n
+    # Pattern-matching ids so one ALL callback can update every row,
+    # indexed by price column so the callback reads them without lookups
+    column = price_store.column_index[item]
+    sparkline_graph_id = {"type": suffix_sparkline_graph, "index": column}
+    count_id = {"type": suffix_count, "index": column}
+    ooc_percentage_id = {"type": suffix_ooc_n, "index": column}
     # ooc_graph_id = item + suffix_ooc_g
     # indicator_id = item + suffix_indicator
 
-    y_array = state_dict[item]["data"][:stopped_interval]
-    y_array = [1/float(y) for y in y_array]
+    # Served from the coarsest rollup level that still gives enough points
+    x_array, y_array = lttb(*price_store.history(item, stopped_interval, sparkline_points), sparkline_points)
+    x_array, y_array = x_array.tolist(), y_array.tolist()
 
     return generate_metric_row(
         div_id,
@@ -502,9 +587,7 @@ def generate_metric_row_helper(stopped_interval, index):
                     {
                         "data": [
                             {
-                                "x": state_dict["Batch"]["data"].tolist()[
-                                    :stopped_interval
-                                ],
+                                "x": x_array,
                                 "y": y_array,
                                 "mode": "lines+markers",
                                 "name": item,
@@ -622,25 +705,23 @@ def build_chart_panel():
     )
 
 
-def generate_graph(interval, specs_dict, portfolio_value, initial_portfolio_value):
+def generate_graph(interval, portfolio_value, stats, initial_portfolio_value):
     if len(portfolio_value) == 0:
         portfolio_value = [initial_portfolio_value]
+        stats = RunningStats()
+        stats.push(initial_portfolio_value)
 
     new_portfolio_value = portfolio_value[-10:]
     x_array = list(range(1, len(new_portfolio_value)+1))
     y_array = new_portfolio_value
 
-    mean = np.mean(portfolio_value)
-    std = np.std(portfolio_value)
+    mean = stats.mean
+    std = stats.std
     ucl = mean + 2 * std
     lcl = mean - 2 * std
 
-    total_count = 0
-
-    if interval > max_length:
-        total_count = max_length - 1
-    elif interval > 0:
-        total_count = interval
+    # The callback already sends only the newest values, which after a
+    # backfill no longer line up with interval
 
     ooc_trace = {
         "x": [],
@@ -650,14 +731,15 @@ def generate_graph(interval, specs_dict, portfolio_value, initial_portfolio_valu
         "marker": dict(color="rgba(210, 77, 87, 0.7)", symbol="square", size=11),
     }
 
-    for index, data in enumerate(y_array[:total_count]):
+    for index, data in enumerate(y_array):
         if data >= ucl or data <= lcl:
             ooc_trace["x"].append(index + 1)
             ooc_trace["y"].append(data)
 
+    # The histogram needs every value; only the line is downsampled
     histo_trace = {
-        "x": x_array[:total_count],
-        "y": y_array[:total_count],
+        "x": x_array,
+        "y": y_array,
         "type": "histogram",
         "orientation": "h",
         "name": "Distribution",
@@ -666,11 +748,12 @@ def generate_graph(interval, specs_dict, portfolio_value, initial_portfolio_valu
         "marker": {"color": "#051C2C"},
     }
 
+    line_x, line_y = lttb(x_array, y_array, chart_max_points)
     fig = {
         "data": [
             {
-                "x": x_array[:total_count],
-                "y": y_array[:total_count],
+                "x": line_x.tolist(),
+                "y": line_y.tolist(),
                 "mode": "lines+markers",
                 "name": "Portfolio Value",
                 "line": {"color": "#051C2C"},
@@ -824,87 +907,60 @@ def generate_graph(interval, specs_dict, portfolio_value, initial_portfolio_valu
     return fig
 
 
-def update_sparkline(interval, param):
-    x_array = state_dict["Batch"]["data"].tolist()
-    y_array = state_dict[param]["data"].tolist()
-    y_array = [1/float(y) for y in y_array]
-
+def update_metric_rows(interval, store, columns):
     if interval == 0:
-        x_new = y_new = None
+        n = len(columns)
+        return ["0"] * n, [dash.no_update] * n, ["0.00"] * n
 
+    if interval >= store.max_length:
+        total_count = store.max_length - 1
     else:
-        if interval >= max_length:
-            total_count = max_length
-        else:
-            total_count = interval
-
-        x_new = x_array[:total_count][-1]
-        y_new = y_array[:total_count][-1]
-
-    return dict(x=[[x_new]], y=[[y_new]]), [0], 50
-
-
-def update_count(interval, col, data):
-    if interval == 0:
-        return "0", "0.00%", 0.00001, "#92e0d3"
+        total_count = interval - 1
 
-    if interval > 0:
+    # One fancy-indexed read covers every row on the page
+    values = store.inv_row(total_count)[columns]
+    x_new = store.batch(total_count)
 
-        if interval >= max_length:
-            total_count = max_length - 1
-        else:
-            total_count = interval - 1
-
-        # ooc_percentage_f = data[col]["ooc"][total_count] * 100
-        ooc_percentage_f = float(1 / data[col]["data"][total_count])
-        ooc_percentage_str = "%.9f" % ooc_percentage_f
-
-        # # Set maximum ooc to 15 for better grad bar display
-        # if ooc_percentage_f > 15:
-        #     ooc_percentage_f = 15
-        #
-        # if ooc_percentage_f == 0.0:
-        #     ooc_grad_val = 0.00001
-        # else:
-        #     ooc_grad_val = float(ooc_percentage_f)
+    counts = [str(total_count + 1)] * len(columns)
+    extend_data = [
+        (dict(x=[[x_new]], y=[[y_new]]), [0], 50) for y_new in values.tolist()
+    ]
+    values_str = ["%.9f" % value for value in values.tolist()]
+    return counts, extend_data, values_str
 
-        # # Set indicator theme according to threshold 5%
-        # if 0 <= ooc_grad_val <= 5:
-        #     color = "#92e0d3"
-        # elif 5 < ooc_grad_val < 7:
-        #     color = "#051C2C"
-        # else:
-        #     color = "#FF0000"
 
-    return str(total_count + 1), ooc_percentage_str
+def serve_layout():
+    return html.Div(
+        id="big-app-container",
+        children=[
+            build_banner(),
+            dcc.Interval(
+                id="interval-component",
+                interval=2000,  # in milliseconds
+                n_intervals=price_store.start_tick(),  # start at batch 50
+                disabled=True,
+            ),
+            html.Div(
+                id="app-container",
+                children=[
+                    # build_tabs(),
+                    # Main app
+                    html.Div(id="app-content"),
+                ],
+            ),
+            dcc.Store(id="session-id", data=new_session_id()),
+            dcc.Store(id="playback-prices", data=playback_payload),
+            dcc.Store(id="n-interval-stage", data=price_store.start_tick()),
+            dcc.Store(id="portfolio-value", data=None),
+            dcc.Store(id="initial-portfolio-value", data=0),
+            dcc.Store(id="owned-currencies", data={}),
+            dcc.Download(id="session-export"),
+            generate_modal(),
+        ],
+    )
 
 
-app.layout = html.Div(
-    id="big-app-container",
-    children=[
-        build_banner(),
-        dcc.Interval(
-            id="interval-component",
-            interval=2000,  # in milliseconds
-            n_intervals=1,  # start at batch 50
-            disabled=True,
-        ),
-        html.Div(
-            id="app-container",
-            children=[
-                # build_tabs(),
-                # Main app
-                html.Div(id="app-content"),
-            ],
-        ),
-        dcc.Store(id="value-setter-store", data=init_value_setter_store()),
-        dcc.Store(id="n-interval-stage", data=1),
-        dcc.Store(id="portfolio-value", data=[]),
-        dcc.Store(id="initial-portfolio-value", data=0),
-        dcc.Store(id="owned-currencies", data={}),
-        generate_modal(),
-    ],
-)
+app.layout = serve_layout
 
 
 @app.callback(
@@ -964,6 +1020,38 @@ def update_interval_state(settings_button, cur_interval, disabled, cur_stage):
     return cur_stage
 
 
+def export_session_archive(n_clicks, session_id, owned_currencies, initial_portfolio_value, interval):
+    check_session_id(session_id)
+    if not n_clicks:
+        raise PreventUpdate
+    store = get_price_store(session_id)
+    buffer = io.BytesIO()
+    with tempfile.TemporaryDirectory() as directory:
+        with portfolio_history.open(session_id) as history:
+            session_archive.export_session(
+                directory, store, valuation, owned_currencies or {}, initial_portfolio_value,
+                max(interval - 1, 0), session_id, history,
+            )
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    path = os.path.join(root, name)
+                    archive.write(path, os.path.relpath(path, directory))
+    return dcc.send_bytes(buffer.getvalue(), "session-{}.zip".format(session_id[:8]))
+
+
+if session_archive.available():
+    app.callback(
+        output=Output("session-export", "data"),
+        inputs=[Input("export-button", "n_clicks")],
+        state=[State("session-id", "data"),
+               State("owned-currencies", "data"),
+               State("initial-portfolio-value", "data"),
+               State("interval-component", "n_intervals")],
+        prevent_initial_call=True,
+    )(export_session_archive)
+
+
 # Callbacks for stopping interval update
 @app.callback(
     [Output("interval-component", "disabled"), Output("stop-button", "buttonText")],
@@ -995,11 +1083,11 @@ def stop_production(n_clicks, current):
     inputs=[Input("value-adder-btn", "n_clicks"),
             Input("value-setter-view-btn", "n_clicks")],
     state=[State("value-setter-panel", "children"),
-           State("value-setter-store", "data"),
+           State("session-id", "data"),
            State("interval-component", "n_intervals")]
            # State("n-interval-stage", "data")]
 )
-def build_value_setter_panel(add_button, remove_button, settings_children, state_value, cur_stage):
+def build_value_setter_panel(add_button, remove_button, settings_children, session_id, cur_stage):
     ctx = dash.callback_context
 
     if not ctx.triggered:
@@ -1010,7 +1098,7 @@ def build_value_setter_panel(add_button, remove_button, settings_children, state
     prop_id = splitted[0]
 
     if prop_id == "value-adder-btn":
-        val = round(1 / state_value[params[1]]["data"][cur_stage], 9)
+        val = round(get_price_store(session_id).inv_price(params[1], cur_stage), 9)
         line = build_value_setter_line(
             "value-setter-panel-{}".format(len(settings_children)),
             val,
@@ -1033,15 +1121,15 @@ def build_value_setter_panel(add_button, remove_button, settings_children, state
      Output({'type': 'num-input', 'index': MATCH}, "value")],
     Input({'type': 'metric-select-dropdown', 'index': MATCH}, "value"),
     [State({'type': 'metric-select-dropdown', 'index': MATCH}, "id"),
-     State("value-setter-store", "data"),
+     State("session-id", "data"),
      State("n-interval-stage", "data"),
      State("owned-currencies", "data")]
 )
-def update_currency_price(value, _id, state_value, cur_stage, owned_currencies):
+def update_currency_price(value, _id, session_id, cur_stage, owned_currencies):
     amount = 0
     if value in owned_currencies:
         amount = owned_currencies[value]["amount"]
-    return round(1 / state_value[value]["data"][cur_stage], 9), amount
+    return round(get_price_store(session_id).inv_price(value, cur_stage), 9), amount
 
 
 # ===== Callbacks to update values based on store data and dropdown selection =====
@@ -1108,12 +1196,15 @@ def update_currency_price(value, _id, state_value, cur_stage, owned_currencies):
         State({'type': 'metric-select-dropdown', 'index': ALL}, 'value'),
         State({'type': 'num-input', 'index': ALL}, "value"),
         State({'type': 'value-div', 'index': ALL}, "children"),
-        State("owned-currencies", "data")
+        State("owned-currencies", "data"),
+        State("session-id", "data"),
+        State("interval-component", "n_intervals")
     ],
 )
-def set_value_setter_store(n_clicks, dd_select, num_input_select, values, owned_currencies):
+def set_value_setter_store(n_clicks, dd_select, num_input_select, values, owned_currencies, session_id, cur_stage):
     if n_clicks is None:
         raise PreventUpdate
+    check_session_id(session_id)
 
     new_df_dict = {
         "Cryptocurrency": [],
@@ -1130,6 +1221,15 @@ def set_value_setter_store(n_clicks, dd_select, num_input_select, values, owned_
     for item in owned_currencies.values():
         new_portfolio_value += item["amount"]
 
+    # Replay the new holdings over every tick so far instead of restarting
+    # the chart from an empty history. Cleared and refilled under one lock
+    # so a tick on another worker cannot land in between
+    with portfolio_history.open(session_id, write=True) as history:
+        history.clear()
+        if owned_currencies:
+            weights = valuation.weights(owned_currencies)
+            history.backfill(valuation.equity_curve(weights, 0, cur_stage + 1), control_chart_window)
+
     if len(owned_currencies) > 0:
         new_df = pd.DataFrame.from_dict(new_df_dict)
         table_title = html.H5("Current configuration:", style={"padding": "0px 2rem"})
@@ -1251,31 +1351,34 @@ def set_value_setter_store(n_clicks, dd_select, num_input_select, values, owned_
 #         )
 
 
-# decorator for list of output
-def create_callback(param):
-    def callback(interval, stored_data):
-        count, ooc_n = update_count(
-            interval, param, stored_data
-        )
-        spark_line_data = update_sparkline(interval, param)
-        return count, spark_line_data, ooc_n
+def update_param_rows(interval, session_id):
+    columns = [output["id"]["index"] for output in dash.callback_context.outputs_list[0]]
+    if not columns:
+        raise PreventUpdate
+    return update_metric_rows(interval, get_price_store(session_id), columns)
 
-    return callback
 
+metric_row_outputs = [
+    Output({"type": suffix_count, "index": ALL}, "children"),
+    Output({"type": suffix_sparkline_graph, "index": ALL}, "extendData"),
+    Output({"type": suffix_ooc_n, "index": ALL}, "children"),
+]
 
-for param in params[1:]:
-    update_param_row_function = create_callback(param)
+if playback_mode == "client":
+    # assets/playback.js
+    app.clientside_callback(
+        ClientsideFunction(namespace="playback", function_name="update_metric_rows"),
+        output=metric_row_outputs,
+        inputs=[Input("interval-component", "n_intervals")],
+        state=[State("playback-prices", "data")],
+    )
+else:
     app.callback(
-        output=[
-            Output(param + suffix_count, "children"),
-            Output(param + suffix_sparkline_graph, "extendData"),
-            Output(param + suffix_ooc_n, "children"),
-            # Output(param + suffix_ooc_g, "value"),
-            # Output(param + suffix_indicator, "color"),
-        ],
+        output=metric_row_outputs,
         inputs=[Input("interval-component", "n_intervals")],
-        state=[State("value-setter-store", "data")],
-    )(update_param_row_function)
+        state=[State("session-id", "data")],
+    )(update_param_rows)
+
 
 @app.callback(
     output=[Output("portfolio-value", "data"),
@@ -1283,26 +1386,25 @@ for param in params[1:]:
     inputs=[
         Input("interval-component", "n_intervals"),
     ],
-    state=[State("value-setter-store", "data"),
+    state=[State("session-id", "data"),
            State("owned-currencies", "data"),
            State("portfolio-value", "data"),
            State("interval-component", "disabled"),
            State("initial-portfolio-value", "data")]
 )
-def update_portfolio_value(interval, data, owned_currencies, portfolio_value, disabled, initial_portfolio_value):
+def update_portfolio_value(interval, session_id, owned_currencies, portfolio_value, disabled, initial_portfolio_value):
     if disabled or not owned_currencies:
         return portfolio_value, "--"
 
-    if len(portfolio_value) == 0:
-        portfolio_value.append(initial_portfolio_value)
+    check_session_id(session_id)
+    new_portfolio_value = valuation.value(valuation.weights(owned_currencies), interval)
 
-    new_portfolio_value = 0
-    for item in owned_currencies:
-        new_portfolio_value += (owned_currencies[item]["amount"] * (1 / data[item]["data"][interval])) / owned_currencies[item]["price"]
+    with portfolio_history.open(session_id, write=True) as history:
+        if history.total == 0:
+            history.append(initial_portfolio_value, control_chart_window)
+        history.append(new_portfolio_value, control_chart_window)
 
-    portfolio_value.append(new_portfolio_value)
-
-    return portfolio_value, str(round(new_portfolio_value, 2)) + "$"
+    return new_portfolio_value, str(round(new_portfolio_value, 2)) + "$"
 
 
 #  ======= button to choose/update figure based on click ============
@@ -1318,17 +1420,22 @@ def update_portfolio_value(interval, data, owned_currencies, portfolio_value, di
         # Input(params[6] + suffix_button_id, "n_clicks"),
         # Input(params[7] + suffix_button_id, "n_clicks"),
     ],
-    state=[State("value-setter-store", "data"),
-           # State("control-chart-live", "figure"),
-           State("portfolio-value", "data"),
+    state=[# State("control-chart-live", "figure"),
+           State("session-id", "data"),
            State("initial-portfolio-value", "data")],
 )
-def update_control_chart(interval, data, portfolio_value, initial_portfolio_value):
+def update_control_chart(interval, session_id, initial_portfolio_value):
     # Find which one has been triggered
     # ctx = dash.callback_context
 
     # if not ctx.triggered:
-    return generate_graph(interval, data, portfolio_value, initial_portfolio_value)
+    check_session_id(session_id)
+    with portfolio_history.open(session_id) as history:
+        if history is None:
+            portfolio_value, stats = [], RunningStats()
+        else:
+            portfolio_value, stats = history.recent(10), history.stats
+    return generate_graph(interval, portfolio_value, stats, initial_portfolio_value)
 
     # if ctx.triggered:
     #     # Get most recently triggered id and prop_type
@@ -1354,11 +1461,10 @@ def update_control_chart(interval, data, portfolio_value, initial_portfolio_valu
     output=Output("piechart", "figure"),
     inputs=[# Input("interval-component", "n_intervals"),
             Input("dashboard-button", "n_clicks")],
-    state=[State("value-setter-store", "data"),
-           State("owned-currencies", "data"),
+    state=[State("owned-currencies", "data"),
            State("initial-portfolio-value", "data")],
 )
-def update_piechart(interval, stored_data, owned_currencies, initial_portfolio_value):
+def update_piechart(interval, owned_currencies, initial_portfolio_value):
     if interval == 0:
         return {
             "data": [],
@@ -1369,8 +1475,8 @@ def update_piechart(interval, stored_data, owned_currencies, initial_portfolio_v
             },
         }
 
-    if interval >= max_length:
-        total_count = max_length - 1
+    if interval >= price_store.max_length:
+        total_count = price_store.max_length - 1
     else:
         total_count = interval - 1
 
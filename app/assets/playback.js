@@ -0,0 +1,69 @@
+// Clientside playback of the metric rows (PLAYBACK_MODE=client).
+// Mirrors update_metric_rows in app.py using the price columns sent once
+// in the playback-prices store, so ticks need no server round trip.
+(function () {
+    var decoded = null;
+
+    function decodeFloat64(packed) {
+        var binary = window.atob(packed);
+        var bytes = new Uint8Array(binary.length);
+        for (var i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        return new Float64Array(bytes.buffer);
+    }
+
+    function decode(prices) {
+        if (decoded === null || decoded.source !== prices.inv_prices) {
+            decoded = {
+                source: prices.inv_prices,
+                ticks: prices.shape[0],
+                width: prices.shape[1],
+                batches: decodeFloat64(prices.batches),
+                invPrices: decodeFloat64(prices.inv_prices)
+            };
+        }
+        return decoded;
+    }
+
+    function updateMetricRows(interval, prices) {
+        var clientside = window.dash_clientside;
+        // Row ids are indexed by price column
+        var columns = clientside.callback_context.outputs_list[0].map(function (output) {
+            return output.id.index;
+        });
+        if (!columns.length || !prices) {
+            throw clientside.PreventUpdate;
+        }
+
+        var n = columns.length;
+        var counts = [], extendData = [], values = [];
+        if (interval === 0) {
+            for (var i = 0; i < n; i++) {
+                counts.push("0");
+                extendData.push(clientside.no_update);
+                values.push("0.00");
+            }
+            return [counts, extendData, values];
+        }
+
+        var data = decode(prices);
+        var totalCount = Math.min(interval, data.ticks) - 1;
+        var xNew = data.batches[totalCount];
+        var row = totalCount * data.width;
+        columns.forEach(function (column) {
+            var yNew = data.invPrices[row + column];
+            counts.push(String(totalCount + 1));
+            extendData.push([{x: [[xNew]], y: [[yNew]]}, [0], 50]);
+            // Match the "%.9f" formatting of the server, including gaps
+            values.push(isNaN(yNew) ? "nan" : yNew.toFixed(9));
+        });
+        return [counts, extendData, values];
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        playback: {
+            update_metric_rows: updateMetricRows
+        }
+    });
+})();
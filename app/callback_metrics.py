@@ -0,0 +1,160 @@
+import bisect
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import flask
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+DISPATCH_PATH = "/_dash-update-component"
+
+
+def _new_entry():
+    return {
+        # One slot per bucket plus +Inf, not cumulative
+        "buckets": [0] * (len(DURATION_BUCKETS) + 1),
+        "duration_sum": 0.0,
+        "request_bytes": 0,
+        "response_bytes": 0,
+        "invocations": {},
+    }
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class CallbackMetrics:
+    """Per-callback latency, payload size and invocation counters.
+
+    Every Dash callback is served by one dispatch route, so timing that
+    route with Flask request hooks covers all of them. Each worker process
+    writes its counters to its own file in directory at most every
+    flush_interval seconds, and /metrics sums the files of all workers,
+    so the numbers add up under gunicorn's pre-fork model.
+    """
+
+    def __init__(self, app, directory=None, flush_interval=1.0):
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(), "crypto-dashboard-metrics")
+        os.makedirs(directory, exist_ok=True)
+        self.app = app
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.entries = {}
+        self._lock = threading.Lock()
+        # Held while writing, so one thread at a time owns the tmp file
+        self._flush_lock = threading.Lock()
+        self._last_flush = 0.0
+
+        server = app.server
+        server.before_request(self._before_request)
+        server.after_request(self._after_request)
+        server.add_url_rule("/metrics", "metrics", self.metrics_view)
+
+    def _callback_name(self):
+        body = flask.request.get_json(silent=True) or {}
+        output = body.get("output", "")
+        callback = self.app.callback_map.get(output, {}).get("callback")
+        return getattr(callback, "__name__", output)
+
+    def _before_request(self):
+        if flask.request.path == DISPATCH_PATH:
+            flask.g.callback_started = time.perf_counter()
+
+    def _after_request(self, response):
+        started = getattr(flask.g, "callback_started", None)
+        if started is None:
+            return response
+
+        duration = time.perf_counter() - started
+        name = self._callback_name()
+        status = str(response.status_code)
+        with self._lock:
+            entry = self.entries.setdefault(name, _new_entry())
+            entry["buckets"][bisect.bisect_left(DURATION_BUCKETS, duration)] += 1
+            entry["duration_sum"] += duration
+            entry["request_bytes"] += flask.request.content_length or 0
+            entry["response_bytes"] += response.calculate_content_length() or 0
+            entry["invocations"][status] = entry["invocations"].get(status, 0) + 1
+        try:
+            self.flush()
+        except OSError:
+            # Losing one flush must not fail the callback it measured
+            logger.exception("Writing callback metrics failed")
+        return response
+
+    def flush(self, force=False):
+        with self._flush_lock:
+            now = time.monotonic()
+            if not force and now - self._last_flush < self.flush_interval:
+                return
+            self._last_flush = now
+            with self._lock:
+                data = json.dumps(self.entries)
+            path = os.path.join(self.directory, "{}.json".format(os.getpid()))
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+    def collect(self):
+        # Files of exited workers are kept so counters never go backwards
+        self.flush(force=True)
+        total = {}
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(path) as f:
+                    entries = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, entry in entries.items():
+                merged = total.setdefault(name, _new_entry())
+                merged["buckets"] = [a + b for a, b in zip(merged["buckets"], entry["buckets"])]
+                merged["duration_sum"] += entry["duration_sum"]
+                merged["request_bytes"] += entry["request_bytes"]
+                merged["response_bytes"] += entry["response_bytes"]
+                for status, count in entry["invocations"].items():
+                    merged["invocations"][status] = merged["invocations"].get(status, 0) + count
+        return total
+
+    def render(self):
+        entries = self.collect()
+        lines = [
+            "# HELP dash_callback_duration_seconds Wall time spent serving a Dash callback.",
+            "# TYPE dash_callback_duration_seconds histogram",
+        ]
+        for name, entry in sorted(entries.items()):
+            label = 'callback="{}"'.format(_label(name))
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS + ("+Inf",), entry["buckets"]):
+                cumulative += count
+                lines.append('dash_callback_duration_seconds_bucket{{{},le="{}"}} {}'.format(label, bound, cumulative))
+            lines.append("dash_callback_duration_seconds_sum{{{}}} {}".format(label, entry["duration_sum"]))
+            lines.append("dash_callback_duration_seconds_count{{{}}} {}".format(label, cumulative))
+
+        for metric, key, help_text in [
+            ("dash_callback_request_bytes_total", "request_bytes", "Bytes received in callback requests."),
+            ("dash_callback_response_bytes_total", "response_bytes", "Bytes sent in callback responses."),
+        ]:
+            lines.append("# HELP {} {}".format(metric, help_text))
+            lines.append("# TYPE {} counter".format(metric))
+            for name, entry in sorted(entries.items()):
+                lines.append('{}{{callback="{}"}} {}'.format(metric, _label(name), entry[key]))
+
+        lines.append("# HELP dash_callback_invocations_total Callback requests by HTTP status.")
+        lines.append("# TYPE dash_callback_invocations_total counter")
+        for name, entry in sorted(entries.items()):
+            for status, count in sorted(entry["invocations"].items()):
+                lines.append('dash_callback_invocations_total{{callback="{}",status="{}"}} {}'.format(
+                    _label(name), status, count))
+        return "\n".join(lines) + "\n"
+
+    def metrics_view(self):
+        return flask.Response(self.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,38 @@
+import math
+
+
+class RunningStats:
+    """Welford running mean and variance for the control chart limits.
+
+    push() adds a value and pop() removes one that has left a rolling
+    window, both in O(1), so the per-tick cost does not grow with the
+    length of the portfolio history.
+    """
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def push(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def pop(self, x):
+        if self.count <= 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        self.count -= 1
+        delta = x - self.mean
+        self.mean -= delta / self.count
+        # Rounding can push M2 slightly negative after many removals
+        self.m2 = max(self.m2 - delta * (x - self.mean), 0.0)
+
+    @property
+    def std(self):
+        # Population standard deviation, same as np.std
+        if self.count == 0:
+            return 0.0
+        return math.sqrt(self.m2 / self.count)
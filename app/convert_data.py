@@ -0,0 +1,26 @@
+"""Convert CSV price histories into the columnar layout app.py memory-maps.
+
+Usage: python convert_data.py [CSV ...]
+
+With no arguments every CSV in data/ is converted into a directory of the
+same name next to it, e.g. data/final_data.csv -> data/final_data/.
+"""
+import glob
+import os
+import sys
+
+from price_store import convert_csv
+
+APP_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+def main(argv):
+    csv_paths = argv or sorted(glob.glob(os.path.join(APP_PATH, "data", "*.csv")))
+    for csv_path in csv_paths:
+        out_dir = os.path.splitext(csv_path)[0]
+        convert_csv(csv_path, out_dir)
+        print("{} -> {}".format(csv_path, out_dir))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
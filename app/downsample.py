@@ -0,0 +1,41 @@
+import numpy as np
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets: pick `threshold` points that keep the shape.
+
+    The first and last points are kept; the ones between are split into
+    threshold - 2 buckets, and from each bucket the point forming the
+    largest triangle with the previously kept point and the mean of the
+    next bucket is kept, so peaks and troughs survive. Each bucket is
+    handled with array operations and the next-bucket means come from
+    cumulative sums, so only the bucket loop runs in Python.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    # Each bucket looks ahead to the next one; the last looks at the final point
+    next_starts = np.append(starts[1:], n - 1)
+    next_ends = np.append(ends[1:], n)
+    sum_x = np.concatenate(([0.0], np.cumsum(x)))
+    sum_y = np.concatenate(([0.0], np.cumsum(y)))
+    next_x = (sum_x[next_ends] - sum_x[next_starts]) / (next_ends - next_starts)
+    next_y = (sum_y[next_ends] - sum_y[next_starts]) / (next_ends - next_starts)
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        s, e = starts[i], ends[i]
+        area = np.abs(
+            (x[a] - next_x[i]) * (y[s:e] - y[a]) - (x[a] - x[s:e]) * (next_y[i] - y[a])
+        )
+        a = s + int(np.argmax(area))
+        selected[i + 1] = a
+    return x[selected], y[selected]
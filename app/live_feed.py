@@ -0,0 +1,411 @@
+import datetime
+import json
+import logging
+import threading
+import time
+
+import numpy as np
+
+from product_table import ProductTable
+from record_codec import decode
+from rollups import RollupEngine
+
+logger = logging.getLogger(__name__)
+
+PRICE_FIELDS = {"ticker": "price", "bar": "close"}
+
+
+def tick_time(ticker, default):
+    """Exchange time of a ticker in epoch seconds, default if it has none."""
+    value = ticker.get("time")
+    if value:
+        try:
+            return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except (ValueError, AttributeError):
+            pass
+    return default
+
+
+class TickerSource:
+    """Where a LiveFeed gets raw ticker messages from.
+
+    read_batch() returns a list of JSON messages (str or bytes), possibly
+    empty, and should return promptly so the feed can keep sampling.
+    """
+
+    def read_batch(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class KinesisSource(TickerSource):
+    """Reads every shard of the stream the Coinbase lambda writes to.
+
+    Records may hold a single message or many packed ones (PACK_RECORDS
+    on the lambda); both are unpacked into individual messages.
+
+    Shards are read independently: a shard that fails is skipped for the
+    round without losing what the others returned. The last sequence
+    number read from each shard is kept, so an expired iterator is
+    replaced with one that resumes right after it.
+    """
+
+    def __init__(self, stream_name, region_name="us-east-1", limit=1000, client=None):
+        if client is None:
+            import boto3
+            client = boto3.client("kinesis", region_name=region_name)
+        self.client = client
+        self.stream_name = stream_name
+        self.limit = limit
+        self.iterators = {}
+        self.sequences = {}
+        self.errors = 0
+        self._open_shards()
+
+    def _open_shards(self):
+        shards = self.client.list_shards(StreamName=self.stream_name)["Shards"]
+        for shard in shards:
+            shard_id = shard["ShardId"]
+            if shard_id in self.iterators:
+                continue
+            # Closed parent shards have an ending sequence number; their
+            # children carry on from where they stopped
+            if "EndingSequenceNumber" in shard["SequenceNumberRange"]:
+                continue
+            self.iterators[shard_id] = self._iterator(shard_id)
+
+    def _iterator(self, shard_id):
+        sequence = self.sequences.get(shard_id)
+        if sequence is None:
+            options = {"ShardIteratorType": "LATEST"}
+        else:
+            options = {"ShardIteratorType": "AFTER_SEQUENCE_NUMBER", "StartingSequenceNumber": sequence}
+        return self.client.get_shard_iterator(
+            StreamName=self.stream_name, ShardId=shard_id, **options
+        )["ShardIterator"]
+
+    def read_batch(self):
+        messages = []
+        closed = []
+        for shard_id, iterator in list(self.iterators.items()):
+            try:
+                response = self.client.get_records(ShardIterator=iterator, Limit=self.limit)
+            except Exception as e:
+                code = getattr(e, "response", {}).get("Error", {}).get("Code")
+                if code == "ExpiredIteratorException":
+                    try:
+                        self.iterators[shard_id] = self._iterator(shard_id)
+                    except Exception:
+                        logger.exception("Renewing the iterator of shard %s failed", shard_id)
+                else:
+                    # Throttled or unavailable: the iterator is still good next round
+                    logger.warning("Reading shard %s failed: %r", shard_id, e)
+                continue
+            for record in response["Records"]:
+                # A bad record is skipped; the shard still moves past it
+                try:
+                    messages.extend(decode(record["Data"]))
+                except Exception as e:
+                    self.errors += 1
+                    logger.warning("Skipping undecodable record %s of shard %s: %r",
+                                   record.get("SequenceNumber"), shard_id, e)
+            if response["Records"]:
+                self.sequences[shard_id] = response["Records"][-1]["SequenceNumber"]
+            next_iterator = response.get("NextShardIterator")
+            if next_iterator is None:
+                closed.append(shard_id)
+            else:
+                self.iterators[shard_id] = next_iterator
+        if closed:
+            for shard_id in closed:
+                del self.iterators[shard_id]
+            self._open_shards()
+        return messages
+
+
+class FileSource(TickerSource):
+    """Stand-in for Kinesis: one ticker message per line of a file.
+
+    The lambda prints every message it forwards, so its logs can be
+    replayed directly.
+    """
+
+    def __init__(self, path, batch_size=100, loop=False):
+        self.path = path
+        self.batch_size = batch_size
+        self.loop = loop
+        self._file = open(path)
+
+    def read_batch(self):
+        messages = []
+        while len(messages) < self.batch_size:
+            line = self._file.readline()
+            if not line:
+                # Stop at the end of the file, or of an empty file when looping
+                if not self.loop or self._file.tell() == 0:
+                    break
+                self._file.seek(0)
+                continue
+            line = line.strip()
+            if line:
+                messages.append(line)
+        return messages
+
+    def close(self):
+        self._file.close()
+
+
+class ProductRing:
+    """Fixed-capacity buffer of the most recent ticks of one product."""
+
+    def __init__(self, capacity):
+        self.prices = np.full(capacity, np.nan)
+        self.total = 0
+
+    def append(self, price):
+        self.prices[self.total % len(self.prices)] = price
+        self.total += 1
+
+    @property
+    def last_price(self):
+        if self.total == 0:
+            return np.nan
+        return self.prices[(self.total - 1) % len(self.prices)]
+
+
+class LiveFeed:
+    """Background consumer that turns a TickerSource into dashboard ticks.
+
+    Raw tickers go into per-product ring buffers. Every sample_interval
+    seconds the latest inverted price of each product is recorded as one
+    row, so the dashboard can keep addressing prices by tick. Ticks are
+    numbered from the epoch, so every gunicorn worker agrees on them.
+
+    Callbacks only read the published snapshot; all I/O happens on the
+    consumer thread. Every ticker's inverted price also goes into rollups
+    kept per second, minute, 15 minutes and hour for charts, and with a
+    writable tick_store it is appended there too, at its exchange time.
+
+    The lambda tags each record with the product's id in its product
+    table and announces that table on the stream ("products" messages);
+    once one has arrived, tagged records find their column by that id.
+    Until then, and for records from another table, the symbol is used.
+    """
+
+    def __init__(self, source, products, sample_interval=2.0, capacity=43200,
+                 ring_capacity=4096, poll_interval=1.0, tick_store=None):
+        self.source = source
+        self.products = list(products)
+        self.sample_interval = sample_interval
+        self.capacity = capacity
+        self.poll_interval = poll_interval
+        self.tick_store = tick_store if tick_store is not None and tick_store.writer else None
+        # The tick store keeps its own persistent ids, by column
+        self.product_table = tick_store.products if tick_store is not None else ProductTable()
+        self.column_pids = self.product_table.intern_all(self.products)
+        self.rings = [ProductRing(ring_capacity) for _ in self.products]
+        self.column_index = {product: i for i, product in enumerate(self.products)}
+        # Column of each id in the lambda's announced table (None if not followed)
+        self.remote_token = None
+        self.remote_columns = []
+        self.rollups = RollupEngine(len(self.products))
+
+        self._ticks = np.zeros(capacity, dtype=np.int64)
+        self._inv_prices = np.full((capacity, len(self.products)), np.nan)
+        self._rows = 0
+        # (ticks, inv_prices, rows) swapped as one reference so readers
+        # never see a half-compacted matrix
+        self.snapshot = (self._ticks, self._inv_prices, 0)
+        self._next_tick = self.current_tick()
+        self._stop = threading.Event()
+        self._thread = None
+        self.messages = 0
+        self.errors = 0
+        # Always have one (empty) row, so ticks resolve before the first sample
+        self.sample()
+
+    def current_tick(self):
+        return int(time.time() // self.sample_interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="live-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.source.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                messages = self.source.read_batch()
+            except Exception:
+                logger.exception("Reading live tickers failed")
+                self.errors += 1
+                messages = []
+            self.ingest(messages)
+            self.sample()
+            # Kinesis allows five reads per shard per second, shared by
+            # every worker process polling the stream
+            self._stop.wait(self.poll_interval)
+
+    def ingest(self, messages):
+        now = time.time()
+        rows = []
+        for message in messages:
+            try:
+                ticker = json.loads(message)
+                # OHLCV bars from the ingestion side count as their close
+                price_field = PRICE_FIELDS.get(ticker.get("type"))
+                if price_field is None:
+                    if ticker.get("type") == "products":
+                        self._adopt(ticker)
+                    continue
+                column = self._column(ticker)
+                if column is None:
+                    continue
+                price = float(ticker[price_field])
+                self.rings[column].append(price)
+                if price > 0:
+                    self.rollups.add(now, column, 1.0 / price)
+                self.messages += 1
+                if self.tick_store is not None:
+                    rows.append((tick_time(ticker, now), self.column_pids[column], price, ticker.get("best_bid"),
+                                 ticker.get("best_ask"), ticker.get("last_size", ticker.get("volume"))))
+            except Exception:
+                # One bad message must not cost the rest of the batch
+                logger.warning("Skipping unreadable live message", exc_info=True)
+                self.errors += 1
+        if rows:
+            self._store(rows)
+
+    def _adopt(self, table):
+        if table["table"] == self.remote_token and len(table["products"]) <= len(self.remote_columns):
+            return
+        self.remote_columns = [self.column_index.get(symbol) for symbol in table["products"]]
+        self.remote_token = table["table"]
+
+    def _column(self, ticker):
+        pid = ticker.get("pid")
+        if pid is not None and ticker.get("pt") == self.remote_token and pid < len(self.remote_columns):
+            return self.remote_columns[pid]
+        return self.column_index.get(ticker["product_id"])
+
+    def _store(self, rows):
+        def number(value):
+            return float(value) if value is not None else np.nan
+
+        # Stored at exchange time; shards interleave, so sort each batch.
+        # A tick older than an earlier batch's newest is clamped forward
+        # by the store
+        rows.sort(key=lambda row: row[0])
+        times, products, prices, bids, asks, sizes = zip(*rows)
+        self.tick_store.append(
+            times, products, prices,
+            [number(v) for v in bids], [number(v) for v in asks], [number(v) for v in sizes],
+        )
+
+    def sample(self):
+        tick = self.current_tick()
+        if tick < self._next_tick:
+            return
+        row = np.array([ring.last_price for ring in self.rings])
+        with np.errstate(divide="ignore"):
+            inv_row = 1.0 / row
+
+        # Forward-fill every tick since the last sample
+        for t in range(max(self._next_tick, tick - self.capacity + 1), tick + 1):
+            if self._rows == self.capacity:
+                self._compact()
+            self._ticks[self._rows] = t
+            self._inv_prices[self._rows] = inv_row
+            self._rows += 1
+        self._next_tick = tick + 1
+        self.snapshot = (self._ticks, self._inv_prices, self._rows)
+
+    def _compact(self):
+        # Drop the oldest half into fresh arrays instead of shifting in
+        # place, so views handed out from the old snapshot stay valid
+        half = self.capacity // 2
+        ticks = np.zeros_like(self._ticks)
+        inv_prices = np.full_like(self._inv_prices, np.nan)
+        ticks[:self._rows - half] = self._ticks[half:self._rows]
+        inv_prices[:self._rows - half] = self._inv_prices[half:self._rows]
+        self._ticks, self._inv_prices = ticks, inv_prices
+        self._rows -= half
+
+
+class LivePriceStore:
+    """PriceStore interface over the samples of a LiveFeed.
+
+    Each lookup works on a single snapshot, since the feed may compact
+    its matrix between two reads.
+    """
+
+    def __init__(self, feed, batch_name="Batch"):
+        self.feed = feed
+        self.params = [batch_name] + feed.products
+        self.column_index = feed.column_index
+
+    def _snapshot(self):
+        ticks, inv_prices, rows = self.feed.snapshot
+        rows = max(rows, 1)
+        return ticks[:rows], inv_prices[:rows]
+
+    @staticmethod
+    def _row(ticks, tick):
+        # Ticks map to rows relative to the oldest sample still held
+        return min(max(int(tick) - int(ticks[0]), 0), len(ticks) - 1)
+
+    @property
+    def tick_seconds(self):
+        return self.feed.sample_interval
+
+    @property
+    def max_length(self):
+        ticks, _ = self._snapshot()
+        return int(ticks[-1]) + 1
+
+    @property
+    def inv_prices(self):
+        return self._snapshot()[1]
+
+    def start_tick(self):
+        return self.feed.current_tick()
+
+    def clamp(self, tick):
+        ticks, _ = self._snapshot()
+        return self._row(ticks, tick)
+
+    def batch(self, tick):
+        ticks, _ = self._snapshot()
+        return int(ticks[self._row(ticks, tick)])
+
+    def inv_price(self, param, tick):
+        ticks, inv_prices = self._snapshot()
+        return float(inv_prices[self._row(ticks, tick), self.column_index[param]])
+
+    def inv_row(self, tick):
+        ticks, inv_prices = self._snapshot()
+        return inv_prices[self._row(ticks, tick)]
+
+    def batch_history(self, stop):
+        ticks, _ = self._snapshot()
+        return ticks[:self._row(ticks, stop - 1) + 1]
+
+    def inv_history(self, param, stop):
+        ticks, inv_prices = self._snapshot()
+        return inv_prices[:self._row(ticks, stop - 1) + 1, self.column_index[param]]
+
+    def history(self, param, stop, points):
+        # Rollups are kept in seconds; charts are drawn in ticks
+        ticks, _ = self._snapshot()
+        interval = self.feed.sample_interval
+        start = int(ticks[0]) * interval
+        end = (int(ticks[self._row(ticks, stop - 1)]) + 1) * interval
+        times, values = self.feed.rollups.query(self.column_index[param], start, end, points)
+        return times / interval, values
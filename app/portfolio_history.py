@@ -0,0 +1,199 @@
+import fcntl
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from control_stats import RunningStats
+from price_store import SESSION_ID_RE
+
+
+def _record_dtype(capacity, archive_capacity):
+    return np.dtype([
+        ("total", np.int64),
+        # RunningStats count, mean and M2
+        ("stats", np.float64, 3),
+        ("ring", np.float64, capacity),
+        ("archive_len", np.int64),
+        ("archive_step", np.int64),
+        ("pending_sum", np.float64),
+        ("pending_n", np.int64),
+        ("archive", np.float64, archive_capacity),
+    ])
+
+
+class PortfolioHistory:
+    """Portfolio values of one session, held in a memory-mapped record.
+
+    The newest `capacity` values are kept exactly in a ring buffer. Older
+    history is kept as block means in a fixed-size archive that halves
+    its resolution whenever it fills up, so the file never grows.
+    """
+
+    def __init__(self, record):
+        self._record = record
+
+    @property
+    def total(self):
+        return int(self._record["total"])
+
+    @property
+    def stats(self):
+        count, mean, m2 = self._record["stats"]
+        return RunningStats(int(count), float(mean), float(m2))
+
+    def clear(self):
+        self._record[()] = np.zeros((), dtype=self._record.dtype)
+        self._record["archive_step"] = 1
+
+    def append(self, value, window=0):
+        rec = self._record
+        capacity = rec["ring"].shape[0]
+        total = int(rec["total"])
+        rec["ring"][total % capacity] = value
+        rec["total"] = total + 1
+
+        stats = self.stats
+        stats.push(value)
+        if window and stats.count > window:
+            stats.pop(float(rec["ring"][(total - window) % capacity]))
+        rec["stats"] = (stats.count, stats.mean, stats.m2)
+
+        self._archive(value)
+
+    def backfill(self, values, window=0):
+        # Same end state as append() over values, in a few array operations
+        if self.total:
+            raise ValueError("Can only backfill an empty history")
+        rec = self._record
+        values = np.asarray(values, dtype=np.float64)
+        total = len(values)
+        capacity = rec["ring"].shape[0]
+        tail = values[-capacity:]
+        rec["ring"][np.arange(total - len(tail), total) % capacity] = tail
+        rec["total"] = total
+
+        windowed = values[-window:] if window else values
+        if len(windowed):
+            mean = windowed.mean()
+            rec["stats"] = (len(windowed), mean, ((windowed - mean) ** 2).sum())
+
+        archive_capacity = rec["archive"].shape[0]
+        step = 1
+        while total // step >= archive_capacity:
+            step *= 2
+        blocks = total // step
+        rec["archive"][:blocks] = values[:blocks * step].reshape(blocks, step).mean(axis=1)
+        rec["archive_len"] = blocks
+        rec["archive_step"] = step
+        rec["pending_sum"] = values[blocks * step:].sum()
+        rec["pending_n"] = total - blocks * step
+
+    def _archive(self, value):
+        rec = self._record
+        rec["pending_sum"] += value
+        rec["pending_n"] += 1
+        if rec["pending_n"] < rec["archive_step"]:
+            return
+
+        archive = rec["archive"]
+        archive_len = int(rec["archive_len"])
+        archive[archive_len] = rec["pending_sum"] / rec["pending_n"]
+        archive_len += 1
+        rec["pending_sum"] = 0.0
+        rec["pending_n"] = 0
+
+        if archive_len == archive.shape[0]:
+            # Full: merge neighbouring blocks and double the block size
+            half = archive_len // 2
+            archive[:half] = archive[:half * 2].reshape(half, 2).mean(axis=1)
+            archive_len = half
+            rec["archive_step"] *= 2
+        rec["archive_len"] = archive_len
+
+    def recent(self, n):
+        rec = self._record
+        capacity = rec["ring"].shape[0]
+        total = int(rec["total"])
+        count = min(n, total, capacity)
+        positions = np.arange(total - count, total) % capacity
+        return rec["ring"][positions].tolist()
+
+    @property
+    def archive_step(self):
+        return int(self._record["archive_step"])
+
+    def archive(self):
+        """Means of consecutive blocks of archive_step values, oldest first."""
+        return self._record["archive"][:int(self._record["archive_len"])].tolist()
+
+
+class PortfolioHistoryStore:
+    """One fixed-size file per session, shared by every gunicorn worker.
+
+    Writers hold an exclusive flock on the session file, so a tick that
+    lands on any worker sees the same history. Files are created empty
+    with O_EXCL and zeroed by the first writer to take the lock, so two
+    workers starting the same session never replace each other's file.
+    """
+
+    def __init__(self, directory=None, capacity=1000, archive_capacity=1024, max_age=24 * 60 * 60):
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(), "crypto-dashboard-history")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dtype = _record_dtype(capacity, archive_capacity)
+        self.max_age = max_age
+
+    def _path(self, session_id):
+        if not SESSION_ID_RE.match(session_id or ""):
+            raise ValueError("Invalid session id: {!r}".format(session_id))
+        return os.path.join(self.directory, session_id + ".hist")
+
+    def _create(self, path):
+        self.expire()
+        try:
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+        except FileExistsError:
+            pass
+
+    @contextmanager
+    def open(self, session_id, write=False):
+        path = self._path(session_id)
+        if not os.path.exists(path):
+            if not write:
+                yield None
+                return
+            self._create(path)
+
+        with open(path, "r+b" if write else "rb") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+            try:
+                empty = os.fstat(f.fileno()).st_size < self.dtype.itemsize
+                if empty:
+                    # Created but not yet zeroed by its first writer
+                    if not write:
+                        yield None
+                        return
+                    f.truncate(self.dtype.itemsize)
+                record = np.memmap(f, dtype=self.dtype, mode="r+" if write else "r", shape=())
+                history = PortfolioHistory(record)
+                if empty:
+                    history.clear()
+                yield history
+                if write:
+                    record.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def expire(self):
+        cutoff = time.time() - self.max_age
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
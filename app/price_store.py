@@ -0,0 +1,144 @@
+import base64
+import json
+import os
+import re
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from rollups import RollupEngine
+
+COLUMNS_FILE = "columns.json"
+BATCHES_FILE = "batches.npy"
+INV_PRICES_FILE = "inv_prices.npy"
+
+SESSION_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def pack_float64(array):
+    # Raw little-endian doubles, base64 encoded for a JSON store
+    data = np.ascontiguousarray(array, dtype="<f8").tobytes()
+    return base64.b64encode(data).decode("ascii")
+
+
+def convert_csv(csv_path, out_dir):
+    # Write the columnar layout that PriceStore.load memory-maps
+    df = pd.read_csv(csv_path)
+    params = list(df)
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(
+        os.path.join(out_dir, BATCHES_FILE),
+        df[params[0]].to_numpy(dtype=np.int64),
+    )
+    np.save(
+        os.path.join(out_dir, INV_PRICES_FILE),
+        np.ascontiguousarray(1.0 / df[params[1:]].to_numpy(dtype=np.float64)),
+    )
+    # Written last so a half-converted directory is never picked up
+    with open(os.path.join(out_dir, COLUMNS_FILE), "w") as f:
+        json.dump(params, f)
+
+
+class PriceStore:
+    """Price history kept on the server and read by tick index.
+
+    Callbacks used to receive the whole dataset as State on every tick;
+    now the browser only sends the tick number and its session key.
+    The dashboard only ever shows inverted prices, so they are computed
+    once into a contiguous (ticks x currencies) matrix.
+    """
+
+    # One tick per dashboard interval
+    tick_seconds = 2.0
+
+    def __init__(self, params, batches, inv_prices):
+        self.params = list(params)
+        self.max_length = len(batches)
+        self.column_index = {col: i for i, col in enumerate(self.params[1:])}
+        self.batches = batches
+        self.inv_prices = inv_prices
+        self._rollups = None
+
+    @classmethod
+    def from_frame(cls, df):
+        params = list(df)
+        return cls(
+            params,
+            df[params[0]].to_numpy(dtype=np.int64),
+            np.ascontiguousarray(1.0 / df[params[1:]].to_numpy(dtype=np.float64)),
+        )
+
+    @classmethod
+    def load(cls, data_dir, csv_path=None):
+        """Memory-map a directory written by convert_csv.
+
+        Every gunicorn worker maps the same files, so they share one copy in
+        the page cache and skip CSV parsing. Falls back to reading csv_path
+        when the directory is missing or older than the CSV.
+        """
+        columns_path = os.path.join(data_dir, COLUMNS_FILE)
+        stale = csv_path is not None and (
+            not os.path.exists(columns_path)
+            or os.path.getmtime(columns_path) < os.path.getmtime(csv_path)
+        )
+        if stale:
+            return cls.from_frame(pd.read_csv(csv_path))
+
+        with open(columns_path) as f:
+            params = json.load(f)
+        return cls(
+            params,
+            np.load(os.path.join(data_dir, BATCHES_FILE), mmap_mode="r"),
+            np.load(os.path.join(data_dir, INV_PRICES_FILE), mmap_mode="r"),
+        )
+
+    def clamp(self, tick):
+        return min(max(int(tick), 0), self.max_length - 1)
+
+    def batch(self, tick):
+        return int(self.batches[self.clamp(tick)])
+
+    def inv_price(self, param, tick):
+        return float(self.inv_prices[self.clamp(tick), self.column_index[param]])
+
+    def inv_row(self, tick):
+        return self.inv_prices[self.clamp(tick)]
+
+    def start_tick(self):
+        return 1
+
+    def batch_history(self, stop):
+        return self.batches[:stop]
+
+    def inv_history(self, param, stop):
+        return self.inv_prices[:stop, self.column_index[param]]
+
+    def history(self, param, stop, points):
+        """Batches and inverse prices before tick stop, about `points` of them.
+
+        Rollup levels are in ticks here; built on first use.
+        """
+        if stop <= 0:
+            return np.empty(0), np.empty(0)
+        if self._rollups is None:
+            self._rollups = RollupEngine.from_rows(self.batches, self.inv_prices)
+        start = int(self.batches[0])
+        return self._rollups.query(self.column_index[param], start, self.batch(stop - 1) + 1, points)
+
+    def playback_payload(self):
+        """Everything the clientside playback callbacks need, sent once.
+
+        Columns are packed as binary doubles rather than JSON numbers so
+        the browser can decode them synchronously into typed arrays.
+        """
+        return {
+            "params": self.params,
+            "shape": list(self.inv_prices.shape),
+            "batches": pack_float64(self.batches),
+            "inv_prices": pack_float64(self.inv_prices),
+        }
@@ -0,0 +1,116 @@
+"""Dense integer ids for product symbols, shared through a small file.
+
+The table is append-only: a symbol keeps its id forever, so ids can be
+stored (tick store columns) and used as array indexes. The file holds
+{"format": 1, "table": token, "version": n, "products": [...]}, where
+version goes up with every addition, and readers reload only when it
+has changed. The token names the table, so ids from one table are never
+looked up in another (the lambda tags records with it, see pipeline.py).
+
+coinbase-lambda/app/product_table.py is a copy; keep the two in sync.
+"""
+import fcntl
+import json
+import os
+import random
+import zlib
+from contextlib import contextmanager
+
+FORMAT = 1
+
+
+class ProductTable:
+    def __init__(self, path=None):
+        # No path keeps the table in memory only
+        self.path = path
+        self.version = 0
+        self.symbols = []
+        self.ids = {}
+        self.token = "{:08x}".format(random.getrandbits(32))
+        self._mtime = None
+        if path is not None:
+            self._load()
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self._mtime:
+                return
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        # Older tick stores wrote a bare list of symbols
+        if isinstance(data, list):
+            data = {"format": FORMAT, "version": len(data), "products": data}
+        if data["format"] != FORMAT:
+            raise ValueError("Unsupported product table format {} in {}".format(data["format"], self.path))
+        self._mtime = mtime
+        # Files written before tokens existed get one derived from their path
+        self.token = data.get("table") or "{:08x}".format(zlib.crc32(self.path.encode("utf-8")))
+        if data["version"] == self.version:
+            return
+        self.version = data["version"]
+        # Append-only, so only new symbols need adding
+        for symbol in data["products"][len(self.symbols):]:
+            self.ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+
+    @contextmanager
+    def _locked(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"format": FORMAT, "table": self.token, "version": self.version, "products": self.symbols}, f)
+        os.replace(tmp, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def get(self, symbol):
+        # In-memory lookup only, for hot paths that interned their symbols up front
+        return self.ids.get(symbol)
+
+    def id(self, symbol):
+        """The id of symbol, or None if it has never been interned."""
+        i = self.ids.get(symbol)
+        if i is None and self.path is not None:
+            # Another process may have added it since we last looked
+            self._load()
+            i = self.ids.get(symbol)
+        return i
+
+    def intern(self, symbol):
+        i = self.ids.get(symbol)
+        if i is not None:
+            return i
+        if self.path is None:
+            self.ids[symbol] = i = len(self.symbols)
+            self.symbols.append(symbol)
+            self.version += 1
+            return i
+        with self._locked():
+            self._load()
+            i = self.ids.get(symbol)
+            if i is None:
+                self.ids[symbol] = i = len(self.symbols)
+                self.symbols.append(symbol)
+                self.version += 1
+                self._save()
+        return i
+
+    def intern_all(self, symbols):
+        return [self.intern(symbol) for symbol in symbols]
+
+    def symbol(self, i):
+        if i >= len(self.symbols) and self.path is not None:
+            self._load()
+        return self.symbols[i]
@@ -0,0 +1,59 @@
+"""Decoder for packed Kinesis records from the Coinbase lambda.
+
+Mirrors the layout written by coinbase-lambda/app/record_codec.py:
+
+    magic b"CBT" | version u8 | codec u8 | count u32 | body
+
+body is count messages, each a u32 length followed by the message bytes,
+compressed as a whole according to codec. Keep the two files in sync.
+"""
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"CBT"
+VERSION = 1
+HEADER = struct.Struct(">3sBBI")
+LENGTH = struct.Struct(">I")
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+
+
+def _decompress(codec, body):
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(body)
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd packed records need the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(body)
+    if codec == CODEC_NONE:
+        return body
+    raise ValueError("Unknown codec {}".format(codec))
+
+
+def is_packed(data):
+    return data[:len(MAGIC)] == MAGIC
+
+
+def decode(data):
+    # Plain single-message records pass through unchanged
+    if not is_packed(data):
+        return [data]
+    _, version, codec, count = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError("Unsupported packed record version {}".format(version))
+    body = _decompress(codec, data[HEADER.size:])
+    messages = []
+    offset = 0
+    for _ in range(count):
+        (length,) = LENGTH.unpack_from(body, offset)
+        offset += LENGTH.size
+        messages.append(body[offset:offset + length])
+        offset += length
+    return messages
@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+
+# Bucket widths, in seconds for live data (ticks for the replayed CSV)
+ROLLUP_LEVELS = (1, 60, 900, 3600)
+
+
+class RollupLevel:
+    """The newest `capacity` buckets of one width, for every column.
+
+    Each ring row holds one bucket's open, high, low, close, sum and count
+    per column. Values may arrive slightly out of order as long as their
+    bucket is still in the ring.
+    """
+
+    def __init__(self, width, capacity, n_columns):
+        self.width = width
+        self.capacity = capacity
+        self.buckets = np.full(capacity, -1, dtype=np.int64)
+        self.open = np.full((capacity, n_columns), np.nan)
+        self.high = np.full((capacity, n_columns), np.nan)
+        self.low = np.full((capacity, n_columns), np.nan)
+        self.close = np.full((capacity, n_columns), np.nan)
+        self.sum = np.zeros((capacity, n_columns))
+        self.count = np.zeros((capacity, n_columns), dtype=np.int64)
+        self.last = -1
+
+    def _row(self, t):
+        bucket = int(t // self.width)
+        if bucket > self.last:
+            # Clear every ring row the new bucket skips over
+            for b in range(max(self.last + 1, bucket - self.capacity + 1), bucket + 1):
+                row = b % self.capacity
+                self.buckets[row] = b
+                self.open[row] = self.high[row] = self.low[row] = self.close[row] = np.nan
+                self.sum[row] = 0.0
+                self.count[row] = 0
+            self.last = bucket
+        row = bucket % self.capacity
+        return row if self.buckets[row] == bucket else None
+
+    def add(self, t, column, value):
+        row = self._row(t)
+        if row is None:
+            return
+        if self.count[row, column] == 0:
+            self.open[row, column] = self.high[row, column] = self.low[row, column] = value
+        else:
+            self.high[row, column] = max(self.high[row, column], value)
+            self.low[row, column] = min(self.low[row, column], value)
+        self.close[row, column] = value
+        self.sum[row, column] += value
+        self.count[row, column] += 1
+
+    def add_row(self, t, values):
+        # One value per column; NaN means no value for that column
+        row = self._row(t)
+        if row is None:
+            return
+        present = ~np.isnan(values)
+        first = present & (self.count[row] == 0)
+        self.open[row, first] = values[first]
+        self.high[row, present] = np.fmax(self.high[row, present], values[present])
+        self.low[row, present] = np.fmin(self.low[row, present], values[present])
+        self.close[row, present] = values[present]
+        self.sum[row, present] += values[present]
+        self.count[row, present] += 1
+
+    def load(self, times, matrix):
+        """Bulk-fill an empty level from rows sorted by time."""
+        groups = pd.DataFrame(matrix).groupby(np.asarray(times) // self.width)
+        buckets = groups.size().index.to_numpy(dtype=np.int64)
+        if not len(buckets):
+            return
+        self.last = int(buckets[-1])
+        # As after add_row(): every bucket of the window is in the ring,
+        # including empty ones, so late values for them are still taken
+        window = np.arange(max(self.last - self.capacity + 1, 0), self.last + 1)
+        self.buckets[window % self.capacity] = window
+        keep = buckets >= window[0]
+        rows = buckets[keep] % self.capacity
+        for field, frame in [("open", groups.first()), ("high", groups.max()), ("low", groups.min()),
+                             ("close", groups.last()), ("sum", groups.sum()), ("count", groups.count())]:
+            getattr(self, field)[rows] = frame.to_numpy()[keep]
+
+    def oldest(self):
+        return max(self.last - self.capacity + 1, 0) * self.width
+
+    def query(self, column, start, stop, field):
+        first = max(int(start // self.width), self.last - self.capacity + 1)
+        last = min(int(np.ceil(stop / self.width)) - 1, self.last)
+        if last < first:
+            return np.empty(0), np.empty(0)
+        buckets = np.arange(first, last + 1)
+        rows = buckets % self.capacity
+        keep = (self.buckets[rows] == buckets) & (self.count[rows, column] > 0)
+        rows = rows[keep]
+        if field == "mean":
+            values = self.sum[rows, column] / self.count[rows, column]
+        else:
+            values = getattr(self, field)[rows, column]
+        return buckets[keep] * self.width, values
+
+
+class RollupEngine:
+    """OHLC and mean rollups of every column at several bucket widths.
+
+    Each value is added to every level as it arrives. A chart asking for
+    `points` across a time range is answered from the coarsest level that
+    still has at least that many buckets in the range, so its cost
+    depends on the screen, not on how long the range is.
+    """
+
+    def __init__(self, n_columns, levels=ROLLUP_LEVELS, capacity=4096):
+        self.levels = [RollupLevel(width, capacity, n_columns) for width in sorted(levels)]
+
+    @classmethod
+    def from_rows(cls, times, matrix, levels=ROLLUP_LEVELS, capacity=4096):
+        # Each level gets just enough buckets to keep the whole span
+        span = float(times[-1] - times[0]) if len(times) else 0.0
+        engine = cls(matrix.shape[1], ())
+        engine.levels = [RollupLevel(width, max(capacity, int(np.ceil(span / width)) + 1), matrix.shape[1])
+                         for width in sorted(levels)]
+        for level in engine.levels:
+            level.load(times, matrix)
+        return engine
+
+    def add(self, t, column, value):
+        for level in self.levels:
+            level.add(t, column, value)
+
+    def add_row(self, t, values):
+        for level in self.levels:
+            level.add_row(t, values)
+
+    def level_for(self, start, stop, points):
+        resolution = (stop - start) / max(points, 1)
+        chosen = self.levels[0]
+        for level in self.levels:
+            if level.width <= resolution:
+                chosen = level
+        # A finer level that no longer reaches back to start is no use
+        while chosen.oldest() > start and chosen is not self.levels[-1]:
+            chosen = self.levels[self.levels.index(chosen) + 1]
+        return chosen
+
+    def query(self, column, start, stop, points, field="close"):
+        """(bucket start times, values) for start <= t < stop at about `points` resolution."""
+        return self.level_for(start, stop, points).query(column, start, stop, field)
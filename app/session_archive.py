@@ -0,0 +1,230 @@
+"""Parquet archive of a session: price history, holdings and equity curve.
+
+Layout of an export directory:
+
+    session.json                       params, tick length, initial value
+    prices/product=<p>/day=<d>/*.parquet   time, batch, inv_price, price
+    equity/day=<d>/*.parquet           time, batch, value
+    holdings.parquet                   product, amount, price, units
+    portfolio.parquet                  first, count, value (archived history)
+
+Times are UTC: tick * tick_seconds from the epoch, which is wall-clock
+time for live sessions and a simulated timeline for the replayed CSV.
+Needs the optional pyarrow package.
+"""
+import datetime
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from price_store import PriceStore
+
+SESSION_FILE = "session.json"
+PRICES_DIR = "prices"
+EQUITY_DIR = "equity"
+HOLDINGS_FILE = "holdings.parquet"
+PORTFOLIO_FILE = "portfolio.parquet"
+# Small row groups keep the time statistics selective within a day file
+ROW_GROUP_ROWS = 4096
+
+TIME_TYPE = pa.timestamp("s", tz="UTC") if pa is not None else None
+
+
+def available():
+    return pa is not None
+
+
+def _require():
+    if pa is None:
+        raise RuntimeError("Parquet export needs the pyarrow package")
+
+
+def _times(batches, tick_seconds):
+    seconds = (np.asarray(batches, dtype=np.float64) * tick_seconds).astype(np.int64)
+    return seconds.astype("datetime64[s]")
+
+
+def _write(table, directory, partition_fields):
+    ds.write_dataset(
+        table,
+        directory,
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([(f, pa.string()) for f in partition_fields]), flavor="hive"),
+        max_rows_per_group=ROW_GROUP_ROWS,
+        min_rows_per_group=min(ROW_GROUP_ROWS, 1024),
+        existing_data_behavior="delete_matching",
+    )
+
+
+def _price_table(store, stop):
+    batches = np.asarray(store.batch_history(stop))
+    times = _times(batches, store.tick_seconds)
+    days = times.astype("datetime64[D]").astype(str)
+    parts = []
+    for product in store.params[1:]:
+        inv = np.asarray(store.inv_history(product, stop), dtype=np.float64)
+        present = ~np.isnan(inv)
+        with np.errstate(divide="ignore"):
+            price = 1.0 / inv[present]
+        parts.append(pd.DataFrame({
+            "time": times[present],
+            "batch": batches[present],
+            "inv_price": inv[present],
+            "price": price,
+            "product": product,
+            "day": days[present],
+        }))
+    frame = pd.concat(parts, ignore_index=True)
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    return table.set_column(table.schema.get_field_index("time"), "time", table["time"].cast(TIME_TYPE))
+
+
+def export_session(directory, store, valuation, owned_currencies, initial_portfolio_value, stop,
+                   session_id=None, history=None):
+    """Write everything up to tick stop under directory.
+
+    With a PortfolioHistory, its downsampled archive of the values the
+    control chart tracked is written too.
+    """
+    _require()
+    os.makedirs(directory, exist_ok=True)
+    # Still a tick: each store maps ticks to its own rows (live stores
+    # hold a recent window, not every tick from 0)
+    stop = int(stop) + 1
+
+    _write(_price_table(store, stop), os.path.join(directory, PRICES_DIR), ["product", "day"])
+
+    # Rows the settings page has not filled in yet have no price
+    owned_currencies = {p: item for p, item in owned_currencies.items() if item["price"]}
+    batches = np.asarray(store.batch_history(stop))
+    weights = valuation.weights(owned_currencies)
+    times = _times(batches, store.tick_seconds)
+    equity = pa.table({
+        "time": pa.array(times, TIME_TYPE),
+        "batch": batches,
+        "value": valuation.equity_curve(weights, 0, stop),
+        "day": times.astype("datetime64[D]").astype(str),
+    })
+    _write(equity, os.path.join(directory, EQUITY_DIR), ["day"])
+
+    products = list(owned_currencies)
+    holdings = pa.table({
+        "product": products,
+        "amount": [float(owned_currencies[p]["amount"]) for p in products],
+        "price": [float(owned_currencies[p]["price"]) for p in products],
+        "units": [float(owned_currencies[p]["amount"]) / float(owned_currencies[p]["price"]) for p in products],
+    })
+    pq.write_table(holdings, os.path.join(directory, HOLDINGS_FILE))
+
+    if history is not None:
+        # Block k is the mean of session values k * step up to (k + 1) * step
+        values = history.archive()
+        step = history.archive_step
+        pq.write_table(pa.table({
+            "first": pa.array(np.arange(len(values), dtype=np.int64) * step),
+            "count": pa.array(np.full(len(values), step, dtype=np.int64)),
+            "value": pa.array(values, pa.float64()),
+        }), os.path.join(directory, PORTFOLIO_FILE))
+
+    with open(os.path.join(directory, SESSION_FILE), "w") as f:
+        json.dump({
+            "session_id": session_id,
+            "params": store.params,
+            "tick_seconds": store.tick_seconds,
+            "initial_portfolio_value": initial_portfolio_value,
+            "stop": stop,
+            "exported_at": datetime.datetime.utcnow().isoformat() + "Z",
+        }, f)
+
+
+def _timestamp(value):
+    # Naive times are taken as UTC
+    value = pd.Timestamp(value)
+    return value.tz_localize("UTC") if value.tzinfo is None else value.tz_convert("UTC")
+
+
+def _filter(products=None, start=None, stop=None):
+    # Partition keys prune whole files; time prunes row groups by their statistics
+    conditions = []
+    if products is not None:
+        conditions.append(ds.field("product").isin(list(products)))
+    if start is not None:
+        start = _timestamp(start)
+        conditions.append(ds.field("day") >= start.strftime("%Y-%m-%d"))
+        conditions.append(ds.field("time") >= pa.scalar(start.to_pydatetime(), TIME_TYPE))
+    if stop is not None:
+        stop = _timestamp(stop)
+        conditions.append(ds.field("day") <= stop.strftime("%Y-%m-%d"))
+        conditions.append(ds.field("time") < pa.scalar(stop.to_pydatetime(), TIME_TYPE))
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def _dataset(directory, name, partition_fields):
+    schema = pa.schema([(f, pa.string()) for f in partition_fields])
+    return ds.dataset(os.path.join(directory, name), format="parquet",
+                      partitioning=ds.partitioning(schema, flavor="hive"))
+
+
+def load_prices(directory, products=None, start=None, stop=None, columns=None):
+    """Price rows of the given products with start <= time < stop, as a pyarrow Table."""
+    _require()
+    dataset = _dataset(directory, PRICES_DIR, ["product", "day"])
+    return dataset.to_table(columns=columns, filter=_filter(products, start, stop))
+
+
+def load_equity(directory, start=None, stop=None):
+    _require()
+    return _dataset(directory, EQUITY_DIR, ["day"]).to_table(filter=_filter(None, start, stop))
+
+
+def load_holdings(directory):
+    _require()
+    table = pq.read_table(os.path.join(directory, HOLDINGS_FILE))
+    return {
+        row["product"]: {"amount": row["amount"], "price": row["price"]}
+        for row in table.to_pylist()
+    }
+
+
+def load_portfolio(directory):
+    """The archived portfolio history as a pyarrow Table, or None if not exported."""
+    _require()
+    path = os.path.join(directory, PORTFOLIO_FILE)
+    if not os.path.exists(path):
+        return None
+    return pq.read_table(path)
+
+
+def load_price_store(directory, products=None, start=None, stop=None):
+    """A PriceStore replaying only the selected products and time range.
+
+    Every column of the exported session is kept so the dashboard layout
+    is unchanged; products left out of the filter stay NaN.
+    """
+    with open(os.path.join(directory, SESSION_FILE)) as f:
+        session = json.load(f)
+    params = session["params"]
+    frame = load_prices(directory, products, start, stop, ["batch", "product", "inv_price"]).to_pandas()
+    if frame.empty:
+        raise ValueError("No exported prices match products={} start={} stop={}".format(products, start, stop))
+    matrix = frame.pivot_table(index="batch", columns="product", values="inv_price", aggfunc="last")
+    matrix = matrix.reindex(columns=params[1:])
+    store = PriceStore(
+        params,
+        matrix.index.to_numpy(dtype=np.int64),
+        np.ascontiguousarray(matrix.to_numpy(dtype=np.float64)),
+    )
+    store.tick_seconds = session["tick_seconds"]
+    return store
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from rollups import RollupEngine, RollupLevel
+
+FIELDS = ["buckets", "open", "high", "low", "close", "count"]
+
+
+def rows(n=5000, columns=3):
+    rng = np.random.default_rng(1)
+    # Uneven spacing with gaps, and NaN for columns without a value
+    times = np.cumsum(rng.choice([0.5, 1.0, 7.0, 120.0], size=n, p=[0.4, 0.4, 0.15, 0.05]))
+    matrix = rng.random((n, columns)) + 1.0
+    matrix[rng.random((n, columns)) < 0.2] = np.nan
+    return times, matrix
+
+
+@pytest.mark.parametrize("width, capacity", [(1, 8192), (60, 4096), (900, 64), (3600, 4)])
+def test_load_matches_add_row(width, capacity):
+    times, matrix = rows()
+    added = RollupLevel(width, capacity, matrix.shape[1])
+    for t, values in zip(times, matrix):
+        added.add_row(t, values)
+    loaded = RollupLevel(width, capacity, matrix.shape[1])
+    loaded.load(times, matrix)
+
+    assert loaded.last == added.last
+    # Only the buckets still in the ring are comparable
+    live = added.buckets >= added.last - capacity + 1
+    for field in FIELDS:
+        np.testing.assert_array_equal(getattr(loaded, field)[live], getattr(added, field)[live], err_msg=field)
+    # Summed in a different order
+    np.testing.assert_allclose(loaded.sum[live], added.sum[live], rtol=1e-12)
+
+
+def test_from_rows_keeps_whole_span():
+    times, matrix = rows()
+    engine = RollupEngine.from_rows(times, matrix, capacity=16)
+    span = times[-1] - times[0]
+    for level in engine.levels:
+        assert level.capacity == max(16, int(np.ceil(span / level.width)) + 1)
+        assert level.oldest() <= times[0]
@@ -0,0 +1,96 @@
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import session_archive
+from live_feed import LiveFeed, LivePriceStore, TickerSource
+from portfolio_history import PortfolioHistoryStore
+from price_store import PriceStore
+from valuation import ValuationEngine
+
+PRODUCTS = ["BTC-USD", "ETH-USD"]
+
+
+class EmptySource(TickerSource):
+    def read_batch(self):
+        return []
+
+
+def replay_store(ticks=300):
+    rng = np.random.default_rng(0)
+    inv_prices = 1.0 / (100 + rng.random((ticks, len(PRODUCTS))))
+    return PriceStore(["Batch"] + PRODUCTS, np.arange(ticks), inv_prices)
+
+
+def live_store(rows=42):
+    # The feed samples its first tick on creation, before any ticker
+    feed = LiveFeed(EmptySource(), PRODUCTS)
+    first_tick = feed.current_tick() + 1
+    for i in range(rows):
+        feed.ingest([json.dumps({"type": "ticker", "product_id": p, "price": str(100 + i + j)})
+                     for j, p in enumerate(PRODUCTS)])
+        feed.current_tick = lambda tick=first_tick + i: tick
+        feed.sample()
+    return LivePriceStore(feed)
+
+
+def holdings(store, tick):
+    return {p: {"amount": 50.0, "price": store.inv_price(p, tick)} for p in PRODUCTS}
+
+
+@pytest.mark.parametrize("make_store", [replay_store, live_store])
+def test_export_round_trip(tmp_path, make_store):
+    store = make_store()
+    ticks = np.asarray(store.batch_history(store.max_length))
+    last = int(ticks[-1])
+    owned = holdings(store, last)
+    session_archive.export_session(str(tmp_path), store, ValuationEngine(store), owned, 100, last)
+
+    prices = session_archive.load_prices(str(tmp_path), columns=["batch", "product", "inv_price"]).to_pandas()
+    for product in PRODUCTS:
+        # Ticks before a product's first price are not exported
+        expected = np.asarray(store.inv_history(product, last + 1))
+        priced = ~np.isnan(expected)
+        rows = prices[prices["product"] == product].sort_values("batch")
+        np.testing.assert_array_equal(rows["batch"], ticks[priced])
+        np.testing.assert_allclose(rows["inv_price"], expected[priced])
+    assert len(prices) >= (len(ticks) - 1) * len(PRODUCTS)
+
+    equity = session_archive.load_equity(str(tmp_path)).to_pandas().sort_values("batch")
+    assert len(equity) == len(ticks)
+    assert equity["value"].iloc[-1] == pytest.approx(100.0)
+    assert session_archive.load_holdings(str(tmp_path))["BTC-USD"]["amount"] == 50.0
+
+
+def test_load_prices_filters(tmp_path):
+    store = replay_store()
+    session_archive.export_session(str(tmp_path), store, ValuationEngine(store), holdings(store, 0), 100, 299)
+    # Ticks are 2s apart: 100 to 199 falls between 200s and 400s
+    table = session_archive.load_prices(str(tmp_path), ["ETH-USD"], "1970-01-01T00:03:20", "1970-01-01T00:06:40")
+    assert sorted(table.column("batch").to_pylist()) == list(range(100, 200))
+    assert set(table.column("product").to_pylist()) == {"ETH-USD"}
+
+    replayed = session_archive.load_price_store(str(tmp_path), ["ETH-USD"])
+    assert replayed.params == store.params
+    assert replayed.inv_price("ETH-USD", 5) == pytest.approx(store.inv_price("ETH-USD", 5))
+    assert np.isnan(replayed.inv_price("BTC-USD", 5))
+
+
+def test_export_portfolio_archive(tmp_path):
+    store = replay_store()
+    histories = PortfolioHistoryStore(str(tmp_path / "history"), capacity=10, archive_capacity=8)
+    session_id = "0" * 32
+    with histories.open(session_id, write=True) as history:
+        history.backfill(np.arange(20.0))
+    with histories.open(session_id) as history:
+        session_archive.export_session(str(tmp_path / "export"), store, ValuationEngine(store),
+                                       holdings(store, 0), 100, 299, session_id, history)
+
+    portfolio = session_archive.load_portfolio(str(tmp_path / "export")).to_pydict()
+    # 20 values in an 8-slot archive are kept as means of blocks of 4
+    assert portfolio["first"] == [0, 4, 8, 12, 16]
+    assert portfolio["count"] == [4] * 5
+    assert portfolio["value"] == [1.5, 5.5, 9.5, 13.5, 17.5]
@@ -0,0 +1,40 @@
+import importlib.util
+import os
+
+import pytest
+
+import product_table
+import record_codec
+
+LAMBDA_APP = os.path.join(os.path.dirname(__file__), "..", "..", "coinbase-lambda", "app")
+
+
+def lambda_module(name):
+    # Same module names as the dashboard's, so load them under another one
+    spec = importlib.util.spec_from_file_location("lambda_" + name, os.path.join(LAMBDA_APP, name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_product_table_copies_match():
+    def source(path):
+        with open(path) as f:
+            # Each copy names the other in its docstring
+            return [line for line in f if "is a copy; keep the two in sync" not in line]
+
+    assert source(product_table.__file__) == source(os.path.join(LAMBDA_APP, "product_table.py"))
+
+
+@pytest.mark.parametrize("codec", ["none", "zlib", "zstd"])
+def test_dashboard_decodes_lambda_records(codec):
+    packer = lambda_module("record_codec")
+    for name in ["MAGIC", "VERSION", "CODEC_NONE", "CODEC_ZLIB", "CODEC_ZSTD"]:
+        assert getattr(record_codec, name) == getattr(packer, name)
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+
+    messages = ['{"type": "ticker", "price": "%d"}' % i for i in range(50)]
+    data = packer.encode(messages, packer.codec_id(codec))
+    assert record_codec.decode(data) == [message.encode("utf-8") for message in messages]
+    assert record_codec.decode(b'{"type": "ticker"}') == [b'{"type": "ticker"}']
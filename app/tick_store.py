@@ -0,0 +1,262 @@
+import fcntl
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from product_table import ProductTable
+
+COLUMNS = [
+    ("time", np.dtype("<f8")),
+    ("product", np.dtype("<i4")),
+    ("price", np.dtype("<f8")),
+    ("bid", np.dtype("<f8")),
+    ("ask", np.dtype("<f8")),
+    ("size", np.dtype("<f8")),
+]
+PRODUCTS_FILE = "products.json"
+LOCK_FILE = "writer.lock"
+META_FILE = "meta.json"
+INDEX_FILE = "index.npy"
+
+
+class Segment:
+    """One directory of fixed-width column files.
+
+    Rows are appended until the segment holds segment_rows; it is then
+    sealed by writing its sparse time index (the time of every
+    index_stride-th row) and a small meta file with its time range and
+    products, so readers can skip it without touching the columns.
+    """
+
+    def __init__(self, path, index_stride):
+        self.path = path
+        self.index_stride = index_stride
+        self.meta = None
+        meta_path = os.path.join(path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+        self._columns = None
+        self._index = None
+
+    @property
+    def sealed(self):
+        return self.meta is not None
+
+    def _column_path(self, name):
+        return os.path.join(self.path, name + ".bin")
+
+    def rows(self):
+        if self.sealed:
+            return self.meta["rows"]
+        # A torn append leaves some columns longer; only whole rows count
+        rows = None
+        for name, dtype in COLUMNS:
+            try:
+                n = os.path.getsize(self._column_path(name)) // dtype.itemsize
+            except FileNotFoundError:
+                n = 0
+            rows = n if rows is None else min(rows, n)
+        return rows
+
+    def columns(self, rows=None):
+        if self.sealed and self._columns is not None:
+            return self._columns
+        rows = self.rows() if rows is None else rows
+        if rows == 0:
+            columns = {name: np.empty(0, dtype) for name, dtype in COLUMNS}
+        else:
+            columns = {
+                name: np.memmap(self._column_path(name), dtype=dtype, mode="r", shape=(rows,))
+                for name, dtype in COLUMNS
+            }
+        if self.sealed:
+            self._columns = columns
+        return columns
+
+    def index(self, times):
+        if self._index is not None:
+            return self._index
+        if self.sealed:
+            self._index = np.load(os.path.join(self.path, INDEX_FILE))
+            return self._index
+        return np.asarray(times[::self.index_stride])
+
+    def row_range(self, times, start, stop):
+        """Rows with start <= time < stop, found through the sparse index."""
+        index = self.index(times)
+        stride = self.index_stride
+        lo = max(int(np.searchsorted(index, start, "left")) - 1, 0) * stride
+        hi = min(int(np.searchsorted(index, stop, "left")) * stride, len(times))
+        if lo >= hi:
+            return lo, lo
+        block = times[lo:hi]
+        return lo + int(np.searchsorted(block, start, "left")), lo + int(np.searchsorted(block, stop, "left"))
+
+    def seal(self):
+        columns = self.columns()
+        times = columns["time"]
+        np.save(os.path.join(self.path, INDEX_FILE), np.asarray(times[::self.index_stride]))
+        meta = {
+            "rows": len(times),
+            "start": float(times[0]) if len(times) else None,
+            "end": float(times[-1]) if len(times) else None,
+            "products": sorted(int(p) for p in np.unique(columns["product"])),
+        }
+        tmp = os.path.join(self.path, META_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.path, META_FILE))
+        self.meta = meta
+
+    def may_contain(self, product, start, stop):
+        if not self.sealed:
+            return True
+        if self.meta["rows"] == 0 or self.meta["end"] < start or self.meta["start"] >= stop:
+            return False
+        return product in self.meta["products"]
+
+
+class TickStore:
+    """Append-only tick history split into memory-mapped segments.
+
+    Each segment holds timestamp, product id, price, bid, ask and size as
+    separate binary columns, with products as ids from the store's
+    ProductTable. Timestamps never go backwards, so a time
+    range is found by binary search over a segment's sparse index and
+    then over one index block, and reading a range only touches the
+    segments and rows that overlap it.
+
+    Every gunicorn worker can read; only the process holding the writer
+    lock appends (writable=True tries to take it without blocking).
+    """
+
+    def __init__(self, directory=None, writable=False, segment_rows=1 << 20, index_stride=4096):
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(), "dash-crypto-ticks")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_rows = segment_rows
+        self.index_stride = index_stride
+        self.products = ProductTable(os.path.join(directory, PRODUCTS_FILE))
+        self._segments = {}
+        self._lock_file = None
+        self._files = None
+        self.last_time = -np.inf
+        if writable:
+            self._take_writer_lock()
+
+    @property
+    def writer(self):
+        return self._lock_file is not None
+
+    def _take_writer_lock(self):
+        lock_file = open(os.path.join(self.directory, LOCK_FILE), "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return
+        self._lock_file = lock_file
+        self._open_active()
+
+    def segments(self):
+        names = sorted(n for n in os.listdir(self.directory) if n.startswith("seg-"))
+        segments = []
+        for name in names:
+            segment = self._segments.get(name)
+            if segment is None or not segment.sealed:
+                segment = Segment(os.path.join(self.directory, name), self.index_stride)
+                self._segments[name] = segment
+            segments.append(segment)
+        return segments
+
+    def _open_active(self):
+        segments = self.segments()
+        sealed = [s for s in segments if s.sealed and s.meta["rows"]]
+        if sealed:
+            self.last_time = sealed[-1].meta["end"]
+        if segments and not segments[-1].sealed:
+            active = segments[-1]
+            rows = active.rows()
+            # Cut back a torn append so every column has the same length
+            for name, dtype in COLUMNS:
+                path = active._column_path(name)
+                if os.path.exists(path):
+                    os.truncate(path, rows * dtype.itemsize)
+            if rows:
+                self.last_time = float(active.columns(rows)["time"][-1])
+        else:
+            name = "seg-{:06d}".format(len(segments))
+            os.makedirs(os.path.join(self.directory, name))
+            active = Segment(os.path.join(self.directory, name), self.index_stride)
+            rows = 0
+        self._active = active
+        self._active_rows = rows
+        self._files = {name: open(active._column_path(name), "ab") for name, _ in COLUMNS}
+
+    def append(self, times, products, prices, bids, asks, sizes):
+        """Append ticks; products are ids from self.products, times are epoch seconds."""
+        if not self.writer:
+            raise RuntimeError("Tick store {} is not open for writing".format(self.directory))
+        if not len(times):
+            return
+        # Clamp so the time column stays sorted even if clocks step back
+        times = np.maximum.accumulate(np.maximum(np.asarray(times, dtype=np.float64), self.last_time))
+        self.last_time = float(times[-1])
+        columns = {
+            "time": times,
+            "product": np.asarray(products, dtype=np.int32),
+            "price": np.asarray(prices, dtype=np.float64),
+            "bid": np.asarray(bids, dtype=np.float64),
+            "ask": np.asarray(asks, dtype=np.float64),
+            "size": np.asarray(sizes, dtype=np.float64),
+        }
+        done = 0
+        while done < len(times):
+            n = min(len(times) - done, self.segment_rows - self._active_rows)
+            for name, dtype in COLUMNS:
+                self._files[name].write(columns[name][done:done + n].astype(dtype, copy=False).tobytes())
+            for f in self._files.values():
+                f.flush()
+            done += n
+            self._active_rows += n
+            if self._active_rows == self.segment_rows:
+                self._roll()
+
+    def _roll(self):
+        for f in self._files.values():
+            f.close()
+        self._active.seal()
+        self._open_active()
+
+    def read(self, product, start=-np.inf, stop=np.inf, columns=("time", "price", "bid", "ask", "size")):
+        """Ticks of one product with start <= time < stop, as a dict of arrays."""
+        pid = self.products.id(product)
+        parts = {name: [] for name in columns}
+        if pid is not None:
+            for segment in self.segments():
+                if not segment.may_contain(pid, start, stop):
+                    continue
+                data = segment.columns()
+                lo, hi = segment.row_range(data["time"], start, stop)
+                if lo == hi:
+                    continue
+                mask = data["product"][lo:hi] == pid
+                for name in columns:
+                    parts[name].append(np.asarray(data[name][lo:hi])[mask])
+        return {
+            name: np.concatenate(parts[name]) if parts[name] else np.empty(0, dict(COLUMNS)[name])
+            for name in columns
+        }
+
+    def close(self):
+        if self._files is not None:
+            for f in self._files.values():
+                f.close()
+            self._files = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
@@ -0,0 +1,31 @@
+import numpy as np
+
+
+class ValuationEngine:
+    """Values holdings against the inverse-price matrix of a PriceStore.
+
+    Holdings become a weight vector over the price columns, so valuing a
+    tick is one dot product and a whole equity curve is one matrix-vector
+    product.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def weights(self, owned_currencies):
+        weights = np.zeros(len(self.store.column_index))
+        for param, item in owned_currencies.items():
+            weights[self.store.column_index[param]] += item["amount"] / item["price"]
+        return weights
+
+    def value(self, weights, tick):
+        # Only held columns take part: the history has gaps (NaN) for
+        # currencies that stopped trading, and 0 * NaN is still NaN
+        held = np.flatnonzero(weights)
+        return float(self.store.inv_row(tick)[held] @ weights[held])
+
+    def equity_curve(self, weights, start, stop):
+        start = self.store.clamp(start)
+        stop = self.store.clamp(stop - 1) + 1
+        held = np.flatnonzero(weights)
+        return self.store.inv_prices[start:stop, held] @ weights[held]
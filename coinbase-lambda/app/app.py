@@ -1,12 +1,55 @@
-import json
+import asyncio
+import os
 import boto3
-from websocket import create_connection
+from websocket import WebSocketTimeoutException
 import time
 
+from async_ingest import ingest_async
+from bars import BarAggregator, parse_windows
+from pipeline import TickerPipeline
+from product_table import ProductTable
+from publisher import BatchPublisher
+from record_codec import PackingPublisher, codec_id
+from sequences import SequenceTracker
+from spool import Spool
+from subscriptions import SubscriptionManager, fetch_product_ids
+from tickers import TickerDecoder
 
-def handler(event, context):
 
-    client = boto3.client("kinesis", region_name="us-east-1")
+def make_publisher(client, stream_name):
+    # Records Kinesis refuses wait in SPOOL_DIR (set it empty to disable)
+    spool_dir = os.environ.get("SPOOL_DIR", "/tmp/coinbase-spool")
+    spool = Spool(os.path.join(spool_dir, stream_name + ".spool")) if spool_dir else None
+    publisher = BatchPublisher(client, stream_name, spool=spool,
+                               drain_timeout=float(os.environ.get("SPOOL_DRAIN_TIMEOUT", 5)))
+    # PACK_RECORDS (none, zlib or zstd) packs many tickers into each record
+    pack_codec = os.environ.get("PACK_RECORDS")
+    if pack_codec:
+        publisher = PackingPublisher(publisher, codec_id(pack_codec))
+    return publisher
+
+
+def build_pipeline(client, products=None):
+    # products (the decoder's ProductTable) tags records with product ids
+    publisher = make_publisher(client, "dev-coinbase-stream")
+
+    # BAR_WINDOWS (e.g. "1s,5s,1m") aggregates tickers into OHLCV bars.
+    # BAR_MODE=replace publishes only the bars, alongside keeps the raw
+    # tickers and sends the bars to BAR_STREAM
+    bar_windows = parse_windows(os.environ.get("BAR_WINDOWS", ""))
+    if not bar_windows:
+        pipeline = TickerPipeline(publisher, products=products)
+    elif os.environ.get("BAR_MODE", "replace") == "alongside":
+        bar_publisher = make_publisher(client, os.environ.get("BAR_STREAM", "dev-coinbase-bars"))
+        pipeline = TickerPipeline(publisher, bar_publisher, [BarAggregator(w) for w in bar_windows],
+                                  products=products)
+    else:
+        pipeline = TickerPipeline(None, publisher, [BarAggregator(w) for w in bar_windows],
+                                  products=products)
+    return pipeline
+
+
+def product_ids():
     list_of_currencies = [
         "42-USD",
         "300-USD",
@@ -3767,23 +3810,83 @@ def handler(event, context):
         "WBTC*-USD",
         "OPET-USD"
     ]
-    ws = create_connection("wss://ws-feed.exchange.coinbase.com")
-    data = json.loads('{"type":"subscribe","product_ids":[],"channels":["ticker",{"name":"ticker","product_ids":[]}]}')
-    data["product_ids"] = list_of_currencies
-    data["channels"][1]["product_ids"] = list_of_currencies
+    # Set SUBSCRIBE_ALL_PRODUCTS to follow every product the exchange lists
+    if os.environ.get("SUBSCRIBE_ALL_PRODUCTS"):
+        list_of_currencies = fetch_product_ids()
+    return list_of_currencies
 
-    ws.send(json.dumps(data))
-    
-    t_end = time.time() + 60 * 1
+
+def open_feed(pipeline, **options):
+    ws = SubscriptionManager(
+        product_ids(),
+        max_per_connection=int(os.environ.get("MAX_PRODUCTS_PER_CONNECTION", 100)),
+        **options
+    ).start()
+    # Wake up at least once per linger period so quiet feeds still flush
+    ws.settimeout(pipeline.max_linger)
+    return ws
+
+
+def make_decoder():
+    # PRODUCT_TABLE keeps product ids stable across runs (in memory if
+    # unset); the subscribed products are interned up front so they get
+    # the same ids every run either way
+    products = ProductTable(os.environ.get("PRODUCT_TABLE"))
+    products.intern_all(product_ids())
+    return TickerDecoder(products)
+
+
+def make_sequence_tracker(ws, decoder):
+    # SEQUENCE_MIN_GAP sets how big a sequence jump counts as a gap;
+    # RESUBSCRIBE_GAP resubscribes a product after a jump at least that big
+    resubscribe_gap = os.environ.get("RESUBSCRIBE_GAP")
+    return SequenceTracker(
+        min_gap=int(os.environ.get("SEQUENCE_MIN_GAP", 1)),
+        resubscribe=ws.resubscribe,
+        resubscribe_gap=int(resubscribe_gap) if resubscribe_gap else None,
+        products=decoder.products,
+    )
+
+
+def ingest_sync(ws, decoder, sequences, pipeline, t_end):
     while time.time() < t_end:
-        message = ws.recv()
-        if json.loads(message)["type"] != "subscriptions" and json.loads(message)["type"] != "error":
+        try:
+            message = ws.recv()
+        except WebSocketTimeoutException:
+            pipeline.poll()
+            continue
+        ticker = decoder.decode(message)
+        if ticker is not None and sequences.check(ticker):
             print(message)
-            client.put_record(
-                StreamName="dev-coinbase-stream",
-                Data=message,
-                PartitionKey=json.loads(message)["product_id"],
-            )
+            pipeline.put(ticker)
+
+
+def ingest(ws, decoder, sequences, pipeline, t_end):
+    # "async" reads the socket and writes to Kinesis on separate threads
+    if os.environ.get("INGESTION_MODE", "sync") == "async":
+        print(asyncio.run(ingest_async(
+            ws, decoder, sequences, pipeline, t_end,
+            queue_size=int(os.environ.get("INGESTION_QUEUE_SIZE", 10000)),
+            overflow=os.environ.get("INGESTION_OVERFLOW", "block"),
+        )))
+    else:
+        ingest_sync(ws, decoder, sequences, pipeline, t_end)
+
+
+def handler(event, context):
+
+    client = boto3.client("kinesis", region_name="us-east-1")
+    decoder = make_decoder()
+    pipeline = build_pipeline(client, decoder.products)
+    ws = open_feed(pipeline)
+    sequences = make_sequence_tracker(ws, decoder)
+
+    t_end = time.time() + 60 * 1
+    ingest(ws, decoder, sequences, pipeline, t_end)
+    pipeline.close()
     ws.close()
 
+    print(decoder.report())
+    print(sequences.report())
+    print(pipeline.stats)
     return "success"
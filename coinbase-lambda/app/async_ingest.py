@@ -0,0 +1,112 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from websocket import WebSocketTimeoutException
+
+
+class QueueStats:
+    def __init__(self):
+        self.enqueued = 0
+        self.dropped = 0
+        self.blocked_seconds = 0.0
+        self.max_depth = 0
+        self.depth_total = 0
+        self.depth_samples = 0
+
+    def sample(self, depth):
+        self.max_depth = max(self.max_depth, depth)
+        self.depth_total += depth
+        self.depth_samples += 1
+
+    def report(self):
+        return {
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "blocked_seconds": round(self.blocked_seconds, 3),
+            "max_queue_depth": self.max_depth,
+            "mean_queue_depth": round(self.depth_total / self.depth_samples, 1) if self.depth_samples else 0,
+        }
+
+
+def _recv_tickers(ws, decoder, max_messages, max_wait):
+    # Runs on the receiving thread: one executor round trip per burst, not per message
+    recv_many = getattr(ws, "recv_many", None)
+    messages = recv_many(max_messages, max_wait) if recv_many is not None else [ws.recv()]
+    tickers = []
+    for message in messages:
+        ticker = decoder.decode(message)
+        if ticker is not None:
+            tickers.append(ticker)
+    return tickers
+
+
+async def _receive(ws, decoder, sequences, queue, t_end, overflow, stats, recv_pool, max_messages, max_wait):
+    loop = asyncio.get_running_loop()
+    while time.time() < t_end:
+        try:
+            tickers = await loop.run_in_executor(recv_pool, _recv_tickers, ws, decoder, max_messages, max_wait)
+        except WebSocketTimeoutException:
+            continue
+        for ticker in tickers:
+            if not sequences.check(ticker):
+                continue
+            if queue.full():
+                if overflow == "drop_oldest":
+                    queue.get_nowait()
+                    stats.dropped += 1
+                else:
+                    # Explicit backpressure: stop reading until there is room
+                    started = time.perf_counter()
+                    await queue.put(ticker)
+                    stats.blocked_seconds += time.perf_counter() - started
+                    stats.enqueued += 1
+                    continue
+            queue.put_nowait(ticker)
+            stats.enqueued += 1
+        stats.sample(queue.qsize())
+
+
+def _publish_batch(pipeline, tickers):
+    for ticker in tickers:
+        pipeline.put(ticker)
+    pipeline.poll()
+
+
+async def _publish(pipeline, queue, receiver, stats, pub_pool):
+    loop = asyncio.get_running_loop()
+    while not (receiver.done() and queue.empty()):
+        try:
+            ticker = await asyncio.wait_for(queue.get(), timeout=pipeline.max_linger)
+        except asyncio.TimeoutError:
+            await loop.run_in_executor(pub_pool, pipeline.poll)
+            continue
+        # Hand everything queued so far to the publishing thread at once
+        tickers = [ticker]
+        while not queue.empty() and len(tickers) < pipeline.max_records:
+            tickers.append(queue.get_nowait())
+        stats.sample(queue.qsize())
+        await loop.run_in_executor(pub_pool, _publish_batch, pipeline, tickers)
+    await loop.run_in_executor(pub_pool, pipeline.flush)
+
+
+async def ingest_async(ws, decoder, sequences, pipeline, t_end, queue_size=10000, overflow="block",
+                       max_messages=1000, max_wait=0.01):
+    """Receive and publish concurrently until t_end.
+
+    The socket is read on one thread and Kinesis is written on another,
+    with a bounded queue between them, so a slow put never delays a recv.
+    The reading thread collects up to max_messages for at most max_wait
+    seconds and decodes them before handing them over, so the thread hop
+    is paid per burst rather than per message.
+    When the queue is full, overflow="block" pauses reading (backpressure)
+    and overflow="drop_oldest" discards the oldest queued ticker instead.
+    Duplicates are dropped by sequences before they reach the queue.
+    """
+    queue = asyncio.Queue(maxsize=queue_size)
+    stats = QueueStats()
+    with ThreadPoolExecutor(1) as recv_pool, ThreadPoolExecutor(1) as pub_pool:
+        receiver = asyncio.create_task(_receive(ws, decoder, sequences, queue, t_end, overflow, stats, recv_pool,
+                                                max_messages, max_wait))
+        await asyncio.gather(receiver, _publish(pipeline, queue, receiver, stats, pub_pool))
+    return stats.report()
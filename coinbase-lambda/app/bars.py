@@ -0,0 +1,90 @@
+import json
+import math
+import time
+
+WINDOW_UNITS = {"s": 1, "m": 60, "h": 3600}
+
+
+def parse_windows(spec):
+    # "1s,5s,1m" -> [1, 5, 60]
+    windows = []
+    for part in spec.split(","):
+        part = part.strip()
+        if part:
+            windows.append(int(part[:-1]) * WINDOW_UNITS[part[-1]])
+    return windows
+
+
+class Bar:
+    __slots__ = ("product_id", "window", "start", "open", "high", "low", "close", "volume", "count")
+
+    def __init__(self, product_id, window, start, price, size):
+        self.product_id = product_id
+        self.window = window
+        self.start = start
+        self.open = self.high = self.low = self.close = price
+        self.volume = size
+        self.count = 1
+
+    def update(self, price, size):
+        if price > self.high:
+            self.high = price
+        if price < self.low:
+            self.low = price
+        self.close = price
+        self.volume += size
+        self.count += 1
+
+    def encode(self):
+        return json.dumps({
+            "type": "bar",
+            "product_id": self.product_id,
+            "window": self.window,
+            "start": self.start,
+            "open": self.open,
+            "high": self.high,
+            "low": self.low,
+            "close": self.close,
+            "volume": self.volume,
+            "count": self.count,
+        })
+
+
+class BarAggregator:
+    """Per-product OHLCV bars over one fixed window, from ticker price and last_size.
+
+    Windows are aligned to the epoch on arrival time. A bar is emitted by
+    add() when its product's next ticker falls in a later window, or by
+    expire() once its window has ended.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.open_bars = {}
+
+    def _start(self, now):
+        return int(now // self.window) * self.window
+
+    def add(self, ticker, now=None):
+        if math.isnan(ticker.price):
+            return None
+        start = self._start(time.time() if now is None else now)
+        size = 0.0 if math.isnan(ticker.last_size) else ticker.last_size
+        bar = self.open_bars.get(ticker.product_id)
+        if bar is not None and bar.start == start:
+            bar.update(ticker.price, size)
+            return None
+        self.open_bars[ticker.product_id] = Bar(ticker.product_id, self.window, start, ticker.price, size)
+        return bar
+
+    def expire(self, now=None):
+        start = self._start(time.time() if now is None else now)
+        done = [bar for bar in self.open_bars.values() if bar.start < start]
+        for bar in done:
+            del self.open_bars[bar.product_id]
+        return done
+
+    def close(self):
+        done = list(self.open_bars.values())
+        self.open_bars.clear()
+        return done
@@ -0,0 +1,291 @@
+"""Offline throughput benchmark for the ingestion path.
+
+A local websocket server (in its own process, so its CPU is not counted)
+replays ticker messages at a fixed rate, and the handler's ingestion
+code reads them through a SubscriptionManager and publishes into an
+in-process fake Kinesis. The pipeline is built by build_pipeline(), so
+the same environment variables apply (INGESTION_MODE, PACK_RECORDS,
+BAR_WINDOWS, ...); the spool is off unless SPOOL_DIR is set.
+
+    python benchmark.py --rate 20000 --seconds 10
+    python benchmark.py --messages tickers.jsonl --out bench.jsonl --label async
+
+Reported: sustained tickers/sec, publish latency percentiles (server send
+to PutRecords arrival) and CPU time per message. With --out, each run is
+appended as one JSON line so changes can be compared over time.
+"""
+import argparse
+import base64
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import socket
+import struct
+import threading
+import time
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def synthetic_messages(products, count):
+    messages = []
+    prices = {p: 100.0 + 10 * i for i, p in enumerate(products)}
+    for i in range(count):
+        product = products[i % len(products)]
+        prices[product] *= 1 + random.gauss(0, 0.0005)
+        messages.append({
+            "type": "ticker", "sequence": 0, "product_id": product,
+            "price": "%.2f" % prices[product], "open_24h": "100.00", "volume_24h": "12345.678",
+            "low_24h": "90.00", "high_24h": "110.00", "volume_30d": "400000.1",
+            "best_bid": "%.2f" % (prices[product] - 0.01), "best_ask": "%.2f" % (prices[product] + 0.01),
+            "side": "buy" if i % 2 else "sell", "time": "2022-08-15T10:00:00.000000Z",
+            "trade_id": i, "last_size": "%.8f" % random.random(),
+        })
+    return messages
+
+
+def recorded_messages(path):
+    # The lambda logs every ticker it forwards, one per line
+    messages = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("{"):
+                fields = json.loads(line)
+                if fields.get("type") == "ticker":
+                    messages.append(fields)
+    return messages
+
+
+def _handshake(conn):
+    request = b""
+    while b"\r\n\r\n" not in request:
+        chunk = conn.recv(4096)
+        if not chunk:
+            raise ConnectionError("closed during handshake")
+        request += chunk
+    key = next(line.split(b":", 1)[1].strip() for line in request.split(b"\r\n")
+               if line.lower().startswith(b"sec-websocket-key:"))
+    accept = base64.b64encode(hashlib.sha1(key + WS_GUID).digest())
+    conn.sendall(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                 b"Connection: Upgrade\r\nSec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+
+
+def _read_frame(conn):
+    # Client frames are always masked
+    def read(n):
+        data = b""
+        while len(data) < n:
+            chunk = conn.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("closed")
+            data += chunk
+        return data
+
+    b0, b1 = read(2)
+    length = b1 & 0x7F
+    if length == 126:
+        (length,) = struct.unpack(">H", read(2))
+    elif length == 127:
+        (length,) = struct.unpack(">Q", read(8))
+    mask = read(4)
+    payload = read(length)
+    return b0 & 0x0F, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+
+def _frame(payload):
+    length = len(payload)
+    if length < 126:
+        header = struct.pack(">BB", 0x81, length)
+    elif length < 1 << 16:
+        header = struct.pack(">BBH", 0x81, 126, length)
+    else:
+        header = struct.pack(">BBQ", 0x81, 127, length)
+    return header + payload
+
+
+def _serve_connection(conn, templates, total_products, rate, t_end, sequences):
+    with conn:
+        _handshake(conn)
+        opcode, payload = _read_frame(conn)
+        products = set(json.loads(payload)["product_ids"])
+        mine = [m for m in templates if m["product_id"] in products]
+        if not mine:
+            return
+        # This connection's share of the overall rate
+        share = rate * len(products) / total_products if rate else 0
+        started = time.time()
+        sent = 0
+        while time.time() < t_end:
+            burst = []
+            due = int((time.time() - started) * share) + 1 if share else sent + 100
+            while sent < due:
+                message = dict(mine[sent % len(mine)])
+                sequences[message["product_id"]] += 1
+                message["sequence"] = sequences[message["product_id"]]
+                message["bench_sent"] = time.time()
+                burst.append(_frame(json.dumps(message).encode("utf-8")))
+                sent += 1
+            try:
+                conn.sendall(b"".join(burst))
+            except OSError:
+                return
+            if share:
+                time.sleep(0.001)
+
+
+def serve(listener, templates, rate, seconds):
+    """Accept connections and stream tickers to each until seconds pass."""
+    products = {m["product_id"] for m in templates}
+    sequences = {p: 0 for p in products}
+    t_end = time.time() + seconds
+    listener.settimeout(0.1)
+    threads = []
+    while time.time() < t_end:
+        try:
+            conn, _ = listener.accept()
+        except socket.timeout:
+            continue
+        thread = threading.Thread(
+            target=_serve_connection,
+            args=(conn, templates, len(products), rate, t_end, sequences),
+            daemon=True,
+        )
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+
+class FakeKinesis:
+    """In-process PutRecords sink that keeps each record and its arrival time."""
+
+    def __init__(self, put_latency=0.0):
+        self.put_latency = put_latency
+        self.records = []
+        self.calls = 0
+
+    def put_records(self, StreamName, Records):
+        if self.put_latency:
+            time.sleep(self.put_latency)
+        now = time.time()
+        self.calls += 1
+        self.records.extend((now, record["Data"]) for record in Records)
+        return {"FailedRecordCount": 0, "Records": [{"SequenceNumber": "0"}] * len(Records)}
+
+    def put_record(self, StreamName, Data, PartitionKey):
+        self.put_records(StreamName, [{"Data": Data, "PartitionKey": PartitionKey}])
+
+    def latencies(self):
+        # Done after the run so parsing is not counted as ingestion CPU
+        from record_codec import decode
+        latencies = []
+        for arrived, data in self.records:
+            for message in decode(data):
+                sent = json.loads(message).get("bench_sent")
+                if sent is not None:
+                    latencies.append(arrived - sent)
+        return latencies
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run(args):
+    os.environ.setdefault("SPOOL_DIR", "")
+    from app import build_pipeline, ingest
+    from sequences import SequenceTracker
+    from subscriptions import SubscriptionManager
+    from tickers import TickerDecoder
+
+    if args.messages:
+        templates = recorded_messages(args.messages)
+    else:
+        products = ["BENCH{}-USD".format(i) for i in range(args.products)]
+        templates = synthetic_messages(products, max(args.products * 20, 1000))
+    product_ids = sorted({m["product_id"] for m in templates})
+
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    port = listener.getsockname()[1]
+    server = multiprocessing.Process(
+        target=serve, args=(listener, templates, args.rate, args.seconds + 1), daemon=True,
+    )
+    server.start()
+
+    sink = FakeKinesis(args.put_latency / 1000)
+    decoder = TickerDecoder()
+    decoder.products.intern_all(product_ids)
+    pipeline = build_pipeline(sink, decoder.products)
+    sequences = SequenceTracker(products=decoder.products)
+    ws = SubscriptionManager(product_ids, max_per_connection=args.per_connection,
+                             url="ws://127.0.0.1:{}".format(port)).start()
+    ws.settimeout(pipeline.max_linger)
+
+    cpu_started = time.process_time()
+    started = time.time()
+    # The handler prints each ticker; keep that cost but not the output
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        ingest(ws, decoder, sequences, pipeline, started + args.seconds)
+        pipeline.close()
+    elapsed = time.time() - started
+    cpu = time.process_time() - cpu_started
+    ws.close()
+    server.join(5)
+    listener.close()
+
+    latencies = sink.latencies()
+    tickers = decoder.tickers
+    return {
+        "label": args.label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "mode": os.environ.get("INGESTION_MODE", "sync"),
+        "pack": os.environ.get("PACK_RECORDS", ""),
+        "offered_rate": args.rate,
+        "products": len(product_ids),
+        "connections": len(ws.connections),
+        "seconds": round(elapsed, 3),
+        "tickers": tickers,
+        "published": len(latencies),
+        "tickers_per_second": round(tickers / elapsed, 1),
+        "put_calls": sink.calls,
+        "latency_ms": {
+            name: round(percentile(latencies, q) * 1000, 3)
+            for name, q in [("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0)]
+        },
+        "cpu_us_per_message": round(cpu / tickers * 1e6, 2) if tickers else 0.0,
+        "decoder": decoder.report()["backend"],
+        "sequences": sequences.report(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=10000, help="messages/sec offered in total, 0 for unthrottled")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--products", type=int, default=50, help="synthetic products")
+    parser.add_argument("--messages", help="replay ticker messages from this file instead")
+    parser.add_argument("--per-connection", type=int, default=100, help="max products per websocket")
+    parser.add_argument("--put-latency", type=float, default=0.0, help="simulated PutRecords latency in ms")
+    parser.add_argument("--label", default="")
+    parser.add_argument("--out", help="append the result as a JSON line to this file")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(json.dumps(result, indent=2))
+    if args.out:
+        with open(args.out, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Continuous ingestion service, for running outside Lambda (e.g. on ECS).
+
+The lambda handler reads for a minute and exits, leaving a gap until the
+next invocation. This keeps the websockets open instead, with heartbeats,
+jittered reconnects and overlapping rotation, until SIGTERM or SIGINT.
+
+    python3 daemon.py
+"""
+import os
+import signal
+import threading
+import time
+
+import boto3
+from websocket import WebSocketTimeoutException
+
+from app import build_pipeline, make_decoder, make_sequence_tracker, open_feed
+
+
+def _env_float(name, default):
+    value = os.environ.get(name, default)
+    return float(value) if value not in (None, "") else None
+
+
+def run(stop):
+    client = boto3.client("kinesis", region_name="us-east-1")
+    decoder = make_decoder()
+    pipeline = build_pipeline(client, decoder.products)
+    ws = open_feed(
+        pipeline,
+        heartbeat_interval=_env_float("HEARTBEAT_INTERVAL", 10),
+        stale_after=_env_float("STALE_AFTER", 60),
+        rotate_after=_env_float("ROTATE_AFTER", 6 * 3600),
+    )
+    # Rotation overlaps two sockets on the same products; the tracker
+    # keeps only the first copy of each sequence number
+    sequences = make_sequence_tracker(ws, decoder)
+    # Empty disables the heartbeat options above, but a report interval is always needed
+    report_interval = _env_float("REPORT_INTERVAL", 60) or 60
+    next_report = time.time() + report_interval
+
+    while not stop.is_set():
+        if time.time() >= next_report:
+            next_report += report_interval
+            print({"feed": ws.stats, "sequences": sequences.report(), "pipeline": pipeline.stats})
+        try:
+            message = ws.recv()
+        except WebSocketTimeoutException:
+            pipeline.poll()
+            continue
+        ticker = decoder.decode(message)
+        if ticker is None:
+            continue
+        ws.observe(ticker.product_id)
+        if sequences.check(ticker):
+            pipeline.put(ticker)
+
+    pipeline.close()
+    ws.close()
+    print(decoder.report())
+    print({"feed": ws.stats, "sequences": sequences.report(), "pipeline": pipeline.stats})
+
+
+def main():
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+    run(stop)
+
+
+if __name__ == "__main__":
+    main()
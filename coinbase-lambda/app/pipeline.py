@@ -0,0 +1,125 @@
+import json
+import time
+
+PRODUCTS_KEY = "products"
+
+
+def tag(raw, pid, token):
+    # Appends the product id and table token to a JSON object without re-encoding it
+    suffix = ',"pid":{},"pt":"{}"}}'.format(pid, token)
+    if isinstance(raw, bytes):
+        raw = raw.rstrip()
+        return raw[:-1] + suffix.encode("utf-8") if raw.endswith(b"}") else raw
+    raw = raw.rstrip()
+    return raw[:-1] + suffix if raw.endswith("}") else raw
+
+
+class TickerPipeline:
+    """Routes decoded tickers to the raw stream, OHLCV bars, or both.
+
+    raw_publisher gets every ticker unchanged; bars from each aggregator go
+    to bar_publisher. Either may be None, and they may be the same
+    publisher when bars share the raw stream. Finished bars are expired
+    from put() at each boundary of the smallest window, so a product that
+    goes quiet still gets its bar without waiting for poll().
+
+    With a products table (the decoder's), every record is tagged with
+    the product's id and the table's token, and the table itself is
+    published as a "products" message whenever it grows and every
+    announce_interval seconds, so consumers can index by id.
+    """
+
+    def __init__(self, raw_publisher=None, bar_publisher=None, aggregators=(), products=None,
+                 announce_interval=60.0):
+        self.raw_publisher = raw_publisher
+        self.bar_publisher = bar_publisher
+        self.aggregators = list(aggregators)
+        self.publishers = []
+        for publisher in (raw_publisher, bar_publisher):
+            if publisher is not None and publisher not in self.publishers:
+                self.publishers.append(publisher)
+        self.tickers = 0
+        self.bars = 0
+        self.expire_window = min((a.window for a in self.aggregators), default=None)
+        self.next_expire = 0.0
+        self.products = products
+        self.announce_interval = announce_interval
+        self.announced_version = None
+        self.next_announce = 0.0
+
+    @property
+    def max_linger(self):
+        return min(p.max_linger for p in self.publishers)
+
+    @property
+    def max_records(self):
+        return min(p.max_records for p in self.publishers)
+
+    def put(self, ticker):
+        self.tickers += 1
+        now = time.time()
+        if self.expire_window is not None and now >= self.next_expire:
+            self._expire(now)
+        if self.products is not None and (self.products.version != self.announced_version
+                                          or now >= self.next_announce):
+            self._announce(now)
+        if self.raw_publisher is not None:
+            raw = ticker.raw
+            if self.products is not None and ticker.pid >= 0:
+                raw = tag(raw, ticker.pid, self.products.token)
+            self.raw_publisher.put(raw, ticker.product_id)
+        for aggregator in self.aggregators:
+            bar = aggregator.add(ticker)
+            if bar is not None:
+                self._put_bar(bar)
+
+    def _put_bar(self, bar):
+        self.bars += 1
+        data = bar.encode()
+        pid = self.products.get(bar.product_id) if self.products is not None else None
+        if pid is not None:
+            data = tag(data, pid, self.products.token)
+        self.bar_publisher.put(data, bar.product_id)
+
+    def _announce(self, now):
+        message = json.dumps({
+            "type": "products",
+            "table": self.products.token,
+            "version": self.products.version,
+            "products": self.products.symbols,
+        })
+        for publisher in self.publishers:
+            publisher.put(message, PRODUCTS_KEY)
+        self.announced_version = self.products.version
+        self.next_announce = now + self.announce_interval
+
+    def _expire(self, now):
+        for aggregator in self.aggregators:
+            for bar in aggregator.expire(now):
+                self._put_bar(bar)
+        self.next_expire = (now // self.expire_window + 1) * self.expire_window
+
+    def poll(self):
+        if self.expire_window is not None:
+            self._expire(time.time())
+        for publisher in self.publishers:
+            publisher.poll()
+
+    def flush(self):
+        for publisher in self.publishers:
+            publisher.flush()
+
+    def close(self):
+        for aggregator in self.aggregators:
+            for bar in aggregator.close():
+                self._put_bar(bar)
+        for publisher in self.publishers:
+            publisher.close()
+
+    @property
+    def stats(self):
+        stats = {"tickers": self.tickers, "bars": self.bars}
+        for name, publisher in [("raw", self.raw_publisher), ("bar", self.bar_publisher)]:
+            if publisher is not None:
+                stats[name] = publisher.stats
+        return stats
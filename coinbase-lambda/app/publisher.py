@@ -0,0 +1,171 @@
+import time
+
+from spool import SpoolReplayer
+
+# PutRecords limits
+MAX_BATCH_RECORDS = 500
+MAX_BATCH_BYTES = 5 * 1024 * 1024
+
+
+class BatchPublisher:
+    """Collects records and sends them to Kinesis with PutRecords.
+
+    A batch is flushed when it reaches max_records, when the next record
+    would take it over max_bytes, or when its oldest record has waited
+    max_linger seconds. Records the batch call rejects are sent again, as
+    one PutRecords call per attempt, with backoff and for no longer than
+    max_retry_time seconds in total.
+
+    With a spool, nothing is dropped or raised when Kinesis is throttling
+    or unreachable: failed records are appended to the spool file, and
+    while it holds anything new batches queue behind them there so the
+    stream keeps arrival order. Rejected records go to the spool straight
+    away instead of being retried in line. poll() replays the spool with
+    backoff and close() keeps at it for up to drain_timeout seconds.
+    """
+
+    def __init__(self, client, stream_name, max_records=MAX_BATCH_RECORDS, max_bytes=MAX_BATCH_BYTES,
+                 max_linger=0.5, max_retries=3, retry_backoff=0.1, max_retry_time=1.0, spool=None,
+                 drain_timeout=5.0):
+        self.client = client
+        self.stream_name = stream_name
+        self.max_records = min(max_records, MAX_BATCH_RECORDS)
+        self.max_bytes = min(max_bytes, MAX_BATCH_BYTES)
+        self.max_linger = max_linger
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_retry_time = max_retry_time
+
+        self.records = []
+        self.size = 0
+        self.first_put = None
+        self._stats = {"records": 0, "batches": 0, "retried": 0, "failed": 0, "spooled": 0}
+        self.spool = spool
+        self.drain_timeout = drain_timeout
+        self.replayer = SpoolReplayer(spool, self._send, max_records) if spool is not None else None
+
+    def put(self, data, partition_key):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        # Partition keys count towards the request size limit too
+        size = len(data) + len(partition_key.encode("utf-8"))
+        if self.records and self.size + size > self.max_bytes:
+            self.flush()
+
+        self.records.append({"Data": data, "PartitionKey": partition_key})
+        self.size += size
+        if self.first_put is None:
+            self.first_put = time.monotonic()
+
+        if len(self.records) >= self.max_records:
+            self.flush()
+        else:
+            self.poll()
+
+    def poll(self):
+        # Flush a batch that has lingered long enough; call while idle
+        if self.first_put is not None and time.monotonic() - self.first_put >= self.max_linger:
+            self.flush()
+        elif self.replayer is not None:
+            self.replayer.drain()
+
+    def flush(self):
+        if not self.records:
+            return
+        records = self.records
+        self.records = []
+        self.size = 0
+        self.first_put = None
+
+        if self.spool is not None and self.spool.pending():
+            self._spool(records)
+            self.replayer.drain()
+            return
+        try:
+            failed, error = self._put(records)
+        except Exception as e:
+            if self.spool is None:
+                raise
+            print("PutRecords failed, spooling {} records: {!r}".format(len(records), e))
+            self._spool(records)
+            self.replayer.backoff()
+            return
+        if not failed:
+            return
+        if self.spool is not None:
+            # The replayer retries with its own backoff, off the ingestion path
+            self._spool(failed)
+            self.replayer.backoff()
+            return
+        failed, error = self._retry(failed, error)
+        if failed:
+            if isinstance(error, Exception):
+                raise error
+            raise RuntimeError("Kinesis rejected {} records: {}".format(len(failed), error))
+
+    def _spool(self, records):
+        self.spool.append(records)
+        self._stats["spooled"] += len(records)
+
+    def _send(self, records):
+        # Replayer callback: how many leading records Kinesis accepted
+        response = self.client.put_records(StreamName=self.stream_name, Records=records)
+        self._stats["batches"] += 1
+        if not response.get("FailedRecordCount"):
+            self._stats["records"] += len(records)
+            return len(records)
+        for accepted, result in enumerate(response["Records"]):
+            if "ErrorCode" in result:
+                self._stats["records"] += accepted
+                return accepted
+        return len(records)
+
+    def _put(self, records):
+        # One PutRecords call; returns the rejected records and the first error code
+        response = self.client.put_records(StreamName=self.stream_name, Records=records)
+        self._stats["batches"] += 1
+        if not response.get("FailedRecordCount"):
+            self._stats["records"] += len(records)
+            return [], None
+        failed = []
+        error = None
+        for record, result in zip(records, response["Records"]):
+            if "ErrorCode" in result:
+                failed.append(record)
+                if error is None:
+                    error = "{}: {}".format(result["ErrorCode"], result.get("ErrorMessage", ""))
+        self._stats["records"] += len(records) - len(failed)
+        return failed, error
+
+    def _retry(self, records, error):
+        # Returns whatever is still rejected once the attempts or max_retry_time run out
+        self._stats["retried"] += len(records)
+        deadline = time.monotonic() + self.max_retry_time
+        for attempt in range(self.max_retries):
+            delay = self.retry_backoff * 2 ** attempt
+            if time.monotonic() + delay > deadline:
+                break
+            time.sleep(delay)
+            try:
+                records, error = self._put(records)
+            except Exception as e:
+                error = e
+            if not records:
+                return [], None
+        self._stats["failed"] += len(records)
+        return records, error
+
+    def close(self):
+        # Whatever is still spooled after drain_timeout stays on disk for the next run
+        self.flush()
+        if self.replayer is not None:
+            self.replayer.wait(time.monotonic() + self.drain_timeout)
+            self.spool.close()
+
+    @property
+    def stats(self):
+        stats = dict(self._stats)
+        if self.replayer is not None:
+            stats.update(self.replayer.stats)
+            stats.update(self.spool.stats)
+        return stats
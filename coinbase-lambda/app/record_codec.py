@@ -0,0 +1,194 @@
+"""Packs many ticker messages into one Kinesis record.
+
+Layout of a packed record:
+
+    magic b"CBT" | version u8 | codec u8 | count u32 | body
+
+body is count messages, each a u32 length followed by the message bytes,
+compressed as a whole according to codec. All integers are big-endian.
+The dashboard side has a matching decoder in app/record_codec.py.
+
+Run as a script to measure bytes per ticker on a file of messages:
+
+    python record_codec.py tickers.jsonl [codec]
+"""
+import math
+import struct
+import sys
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"CBT"
+VERSION = 1
+HEADER = struct.Struct(">3sBBI")
+LENGTH = struct.Struct(">I")
+
+# Kinesis bills PUT payload units of 25 KiB per record
+PUT_PAYLOAD_UNIT = 25 * 1024
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODECS = {"none": CODEC_NONE, "zlib": CODEC_ZLIB, "zstd": CODEC_ZSTD}
+
+
+def _compress(codec, body):
+    if codec == CODEC_ZLIB:
+        return zlib.compress(body, 6)
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    return body
+
+
+def _decompress(codec, body):
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(body)
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdDecompressor().decompress(body)
+    if codec == CODEC_NONE:
+        return body
+    raise ValueError("Unknown codec {}".format(codec))
+
+
+def codec_id(name):
+    if name == "zstd" and zstandard is None:
+        raise ValueError("zstd packing needs the zstandard package")
+    return CODECS[name]
+
+
+def encode(messages, codec=CODEC_ZLIB):
+    parts = []
+    for message in messages:
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+        parts.append(LENGTH.pack(len(message)))
+        parts.append(message)
+    body = _compress(codec, b"".join(parts))
+    return HEADER.pack(MAGIC, VERSION, codec, len(messages)) + body
+
+
+def is_packed(data):
+    return data[:len(MAGIC)] == MAGIC
+
+
+def decode(data):
+    # Plain single-message records pass through, so old producers still work
+    if not is_packed(data):
+        return [data]
+    _, version, codec, count = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError("Unsupported packed record version {}".format(version))
+    body = _decompress(codec, data[HEADER.size:])
+    messages = []
+    offset = 0
+    for _ in range(count):
+        (length,) = LENGTH.unpack_from(body, offset)
+        offset += LENGTH.size
+        messages.append(body[offset:offset + length])
+        offset += length
+    return messages
+
+
+class PackingPublisher:
+    """Publisher front end that packs messages per partition key.
+
+    Messages for one key are collected until they reach max_bytes
+    (uncompressed), max_count or have waited max_linger, then sent as a
+    single record through the wrapped BatchPublisher. Keeping one key per
+    record preserves per-product ordering within its shard. Lingering
+    groups are sent from put() as well as poll(), so a busy feed that
+    never goes idle still sees them within max_linger.
+    """
+
+    def __init__(self, publisher, codec=CODEC_ZLIB, max_bytes=256 * 1024, max_count=1000):
+        self.publisher = publisher
+        self.codec = codec
+        self.max_bytes = max_bytes
+        self.max_count = max_count
+        self.max_linger = publisher.max_linger
+        self.max_records = publisher.max_records
+        # key -> [messages, uncompressed size, time of first message], oldest first
+        self.groups = {}
+        self.packing = {"messages": 0, "records": 0, "raw_bytes": 0, "packed_bytes": 0}
+
+    def put(self, data, partition_key):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        now = time.monotonic()
+        self._expire(now)
+        group = self.groups.get(partition_key)
+        if group is None:
+            group = self.groups[partition_key] = [[], 0, now]
+        group[0].append(data)
+        group[1] += len(data)
+        if group[1] >= self.max_bytes or len(group[0]) >= self.max_count:
+            self._emit(partition_key)
+
+    def _expire(self, now):
+        # A group is re-inserted after every emit, so dict order is first-message order
+        while self.groups:
+            key, group = next(iter(self.groups.items()))
+            if now - group[2] < self.max_linger:
+                break
+            self._emit(key)
+
+    def _emit(self, partition_key):
+        messages, size, _ = self.groups.pop(partition_key)
+        record = encode(messages, self.codec)
+        self.packing["messages"] += len(messages)
+        self.packing["records"] += 1
+        self.packing["raw_bytes"] += size
+        self.packing["packed_bytes"] += len(record)
+        self.publisher.put(record, partition_key)
+
+    def poll(self):
+        self._expire(time.monotonic())
+        self.publisher.poll()
+
+    def flush(self):
+        for key in list(self.groups):
+            self._emit(key)
+        self.publisher.flush()
+
+    def close(self):
+        self.flush()
+        self.publisher.close()
+
+    @property
+    def stats(self):
+        stats = dict(self.publisher.stats)
+        stats.update(self.packing)
+        if self.packing["messages"]:
+            stats["raw_bytes_per_ticker"] = round(self.packing["raw_bytes"] / self.packing["messages"], 1)
+            stats["packed_bytes_per_ticker"] = round(self.packing["packed_bytes"] / self.packing["messages"], 1)
+        return stats
+
+
+def measure(messages, codec=CODEC_ZLIB, per_record=100):
+    """Bytes per ticker today (one record each) against packed records."""
+    raw_sizes = [len(m.encode("utf-8") if isinstance(m, str) else m) for m in messages]
+    packed_sizes = [
+        len(encode(messages[i:i + per_record], codec))
+        for i in range(0, len(messages), per_record)
+    ]
+    raw, packed = sum(raw_sizes), sum(packed_sizes)
+    return {
+        "tickers": len(messages),
+        "raw_bytes_per_ticker": round(raw / len(messages), 1),
+        "packed_bytes_per_ticker": round(packed / len(messages), 1),
+        "reduction": round(1 - packed / raw, 3),
+        "raw_put_units": sum(math.ceil(size / PUT_PAYLOAD_UNIT) for size in raw_sizes),
+        "packed_put_units": sum(math.ceil(size / PUT_PAYLOAD_UNIT) for size in packed_sizes),
+    }
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1]) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    codec = codec_id(sys.argv[2] if len(sys.argv) > 2 else "zlib")
+    print(measure(lines, codec))
@@ -0,0 +1,81 @@
+import time
+from array import array
+
+from product_table import ProductTable
+
+
+class SequenceTracker:
+    """Last sequence number per product, with gap and duplicate counters.
+
+    Sequences are kept in arrays of 64-bit ints indexed by the product's
+    interned id (Ticker.pid, from the decoder's ProductTable), so memory
+    and lookups stay flat however many products are followed. check()
+    returns False for a ticker whose sequence is not newer than the last
+    one seen (a duplicate, or a late copy from an overlapping
+    connection), which the caller should drop.
+
+    Ticker sequences come from each product's full channel and normally
+    skip numbers, so only jumps of more than min_gap count as gaps. A
+    jump of resubscribe_gap or more calls resubscribe(product_id), at
+    most once per cooldown seconds per product.
+    """
+
+    def __init__(self, min_gap=1, resubscribe=None, resubscribe_gap=None, cooldown=60.0, products=None):
+        self.products = products if products is not None else ProductTable()
+        self.min_gap = min_gap
+        self.resubscribe = resubscribe
+        self.resubscribe_gap = resubscribe_gap
+        self.cooldown = cooldown
+        # -1 marks a product not seen yet
+        self.last = array("q")
+        self.missing = array("q")
+        self.last_resubscribe = {}
+        self.checked = 0
+        self.gaps = 0
+        self.duplicates = 0
+        self.resubscribes = 0
+
+    def check(self, ticker):
+        self.checked += 1
+        if ticker.sequence < 0:
+            return True
+        i = ticker.pid if ticker.pid >= 0 else self.products.intern(ticker.product_id)
+        if i >= len(self.last):
+            grow = i + 1 - len(self.last)
+            self.last.extend([-1] * grow)
+            self.missing.extend([0] * grow)
+        if self.last[i] < 0:
+            self.last[i] = ticker.sequence
+            return True
+
+        jump = ticker.sequence - self.last[i]
+        if jump <= 0:
+            self.duplicates += 1
+            return False
+        self.last[i] = ticker.sequence
+        if jump > self.min_gap:
+            self.gaps += 1
+            self.missing[i] += jump - 1
+            if self.resubscribe_gap is not None and jump >= self.resubscribe_gap:
+                self._resubscribe(ticker.product_id)
+        return True
+
+    def _resubscribe(self, product_id):
+        now = time.monotonic()
+        if now - self.last_resubscribe.get(product_id, -self.cooldown) < self.cooldown:
+            return
+        self.last_resubscribe[product_id] = now
+        self.resubscribes += 1
+        if self.resubscribe is not None:
+            self.resubscribe(product_id)
+
+    def report(self, top=5):
+        worst = sorted(range(len(self.missing)), key=self.missing.__getitem__, reverse=True)[:top]
+        return {
+            "products": sum(1 for last in self.last if last >= 0),
+            "checked": self.checked,
+            "gaps": self.gaps,
+            "duplicates": self.duplicates,
+            "resubscribes": self.resubscribes,
+            "most_missing": {self.products.symbol(i): self.missing[i] for i in worst if self.missing[i]},
+        }
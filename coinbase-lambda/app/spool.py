@@ -0,0 +1,176 @@
+import os
+import struct
+import time
+
+# arrival time, partition key length, data length
+FRAME = struct.Struct(">dHI")
+
+
+class Spool:
+    """Append-only file of records that could not be published.
+
+    Records are framed as arrival time, partition key and data, and read
+    back in the order they were written. The read position lives in a
+    separate offset file that is replaced atomically, so a crash at any
+    point leaves every unacknowledged record on disk. Once everything has
+    been acknowledged the file is truncated.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset_path = path + ".offset"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a+b")
+        self.offset = self._read_offset()
+        self.records, self.oldest = self._scan()
+
+    def _read_offset(self):
+        try:
+            with open(self.offset_path) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_offset(self, offset):
+        tmp = self.offset_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.offset_path)
+        self.offset = offset
+
+    def _scan(self):
+        # Count pending records and drop a frame torn by a crash mid-append
+        records = 0
+        oldest = None
+        end = self.offset
+        for arrived, _, _, end in self._frames(self.offset):
+            records += 1
+            if oldest is None:
+                oldest = arrived
+        if end < os.path.getsize(self.path):
+            self._file.truncate(end)
+        return records, oldest
+
+    def _frames(self, offset, limit=None):
+        # Yields (arrival time, partition key, data, offset after the frame)
+        self._file.seek(offset)
+        count = 0
+        while limit is None or count < limit:
+            header = self._file.read(FRAME.size)
+            if len(header) < FRAME.size:
+                return
+            arrived, key_length, data_length = FRAME.unpack(header)
+            body = self._file.read(key_length + data_length)
+            if len(body) < key_length + data_length:
+                return
+            offset += FRAME.size + len(body)
+            count += 1
+            yield arrived, body[:key_length].decode("utf-8"), body[key_length:], offset
+
+    def append(self, records, arrived=None):
+        """Append PutRecords-style dicts and sync them to disk."""
+        if not records:
+            return
+        arrived = time.time() if arrived is None else arrived
+        parts = []
+        for record in records:
+            key = record["PartitionKey"].encode("utf-8")
+            parts.append(FRAME.pack(arrived, len(key), len(record["Data"])))
+            parts.append(key)
+            parts.append(record["Data"])
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(b"".join(parts))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        if self.oldest is None:
+            self.oldest = arrived
+        self.records += len(records)
+
+    def peek(self, limit):
+        """The oldest pending records, with the offset just past each one."""
+        return [
+            ({"Data": data, "PartitionKey": key}, end)
+            for _, key, data, end in self._frames(self.offset, limit)
+        ]
+
+    def ack(self, count, offset):
+        """Mark the first count pending records, ending at offset, as published."""
+        self.records -= count
+        if self.records == 0:
+            self._file.truncate(0)
+            self._write_offset(0)
+            self.oldest = None
+            return
+        self._write_offset(offset)
+        self.oldest = next(self._frames(offset, 1))[0]
+
+    def pending(self):
+        return self.records > 0
+
+    @property
+    def stats(self):
+        return {
+            "spooled_records": self.records,
+            "spooled_bytes": os.path.getsize(self.path) - self.offset,
+            "lag_seconds": round(time.time() - self.oldest, 3) if self.oldest is not None else 0.0,
+        }
+
+    def close(self):
+        self._file.close()
+
+
+class SpoolReplayer:
+    """Drains a Spool in arrival order with exponential backoff.
+
+    send(records) publishes a list of records and returns how many of
+    them, from the front, were accepted; it may also raise. Everything
+    after the first rejected record is sent again on the next attempt,
+    so delivery is at least once but never reordered past a failure.
+    """
+
+    def __init__(self, spool, send, batch_size=500, base_delay=0.5, max_delay=30.0):
+        self.spool = spool
+        self.send = send
+        self.batch_size = batch_size
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.delay = base_delay
+        self.next_attempt = 0.0
+        self.stats = {"replayed": 0, "replay_failures": 0}
+
+    def backoff(self):
+        self.next_attempt = time.monotonic() + self.delay
+        self.delay = min(self.delay * 2, self.max_delay)
+
+    def drain(self, deadline=None):
+        """Replay batches until the spool is empty, a send fails or deadline passes."""
+        while self.spool.pending():
+            if time.monotonic() < self.next_attempt:
+                return
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            batch = self.spool.peek(self.batch_size)
+            try:
+                accepted = self.send([record for record, _ in batch])
+            except Exception as e:
+                print("Spool replay failed: {!r}".format(e))
+                accepted = 0
+            if accepted:
+                self.spool.ack(accepted, batch[accepted - 1][1])
+                self.stats["replayed"] += accepted
+            if accepted < len(batch):
+                self.stats["replay_failures"] += 1
+                self.backoff()
+                return
+            self.delay = self.base_delay
+
+    def wait(self, deadline):
+        """Keep draining, sleeping out the backoff, until empty or deadline."""
+        while self.spool.pending() and time.monotonic() < deadline:
+            self.drain(deadline)
+            if self.spool.pending():
+                time.sleep(max(0.0, min(self.next_attempt, deadline) - time.monotonic()))
@@ -0,0 +1,295 @@
+import json
+import queue
+import random
+import threading
+import time
+import urllib.request
+
+from websocket import WebSocketTimeoutException, create_connection
+
+FEED_URL = "wss://ws-feed.exchange.coinbase.com"
+PRODUCTS_URL = "https://api.exchange.coinbase.com/products"
+
+
+def fetch_product_ids(url=PRODUCTS_URL, timeout=10):
+    # Every product the exchange currently lists as online
+    request = urllib.request.Request(url, headers={"User-Agent": "coinbase-lambda"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        products = json.load(response)
+    return sorted(p["id"] for p in products if p.get("status", "online") == "online")
+
+
+def subscribe_message(product_ids, channels=("ticker",), kind="subscribe"):
+    return json.dumps({"type": kind, "product_ids": list(product_ids), "channels": list(channels)})
+
+
+class FeedConnection(threading.Thread):
+    """One websocket carrying a share of the product universe."""
+
+    def __init__(self, manager, product_ids, delay=0.0):
+        super().__init__(daemon=True)
+        self.manager = manager
+        self.product_ids = list(product_ids)
+        self.delay = delay
+        self.ws = None
+        self.error = None
+        self.created = time.time()
+        self.connected = None
+        self.first_message = None
+        self.last_message = None
+        # Rotation: the connection taking over, and the one being replaced
+        self.successor = None
+        self.predecessor = None
+        self.retired = False
+        self._lock = threading.Lock()
+
+    def run(self):
+        try:
+            # Backoff before reconnecting happens here, off the reading loop
+            if self.delay:
+                time.sleep(self.delay)
+            self.ws = self.manager.connect(self.manager.url)
+            self.connected = time.time()
+            self.ws.send(subscribe_message(self.product_ids, self.manager.channels))
+            while not self.manager.closing and not self.retired:
+                message = self.ws.recv()
+                self.last_message = time.time()
+                if self.first_message is None:
+                    self.first_message = self.last_message
+                self.manager.messages.put(message)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.manager.dead.put(self)
+
+    def resubscribe(self, product_ids):
+        # Unsubscribe and subscribe again to restart a product's stream
+        with self._lock:
+            self.ws.send(subscribe_message(product_ids, self.manager.channels, "unsubscribe"))
+            self.ws.send(subscribe_message(product_ids, self.manager.channels))
+
+    def heartbeat(self, now, stale_after=None):
+        # Ping to keep the socket alive; close it if it has gone quiet so
+        # the manager reconnects
+        if self.ws is None:
+            return
+        try:
+            if stale_after and now - (self.last_message or self.connected) > stale_after:
+                print("Connection for {} products silent for {}s, closing".format(len(self.product_ids), stale_after))
+                self.ws.close()
+            else:
+                self.ws.ping()
+        except Exception as e:
+            self.error = e
+
+    def add_products(self, product_ids):
+        # Takes over products of a connection that died
+        with self._lock:
+            self.ws.send(subscribe_message(product_ids, self.manager.channels))
+            self.product_ids.extend(product_ids)
+
+    def close(self):
+        if self.ws is not None:
+            self.ws.close()
+
+
+class SubscriptionManager:
+    """Spreads product subscriptions over several websocket connections.
+
+    Each connection carries at most max_per_connection products and runs
+    its own reader thread; all of them feed one queue, so recv() merges
+    the streams into a single websocket-like source for the publishing
+    loop. When a connection dies its products are moved to connections
+    with spare room, and whatever does not fit gets a new connection after
+    a jittered exponential backoff.
+
+    For long-running use, heartbeat_interval pings every socket and closes
+    any that has been silent for stale_after seconds, and rotate_after
+    replaces each connection once it is that old: the new one subscribes
+    and must deliver a message before the old one is closed, so both run
+    side by side for a moment and the consumer should drop duplicates.
+    The gap between the last message of a dead connection and the next
+    ticker for one of its products is recorded per reconnect; call
+    observe() for each ticker to feed it.
+    """
+
+    def __init__(self, product_ids, max_per_connection=50, url=FEED_URL, channels=("ticker",),
+                 connect=create_connection, queue_size=100000, heartbeat_interval=None,
+                 stale_after=None, rotate_after=None, backoff_base=0.5, backoff_cap=30.0):
+        self.product_ids = list(product_ids)
+        self.max_per_connection = max_per_connection
+        self.url = url
+        self.channels = channels
+        self.connect = connect
+        self.messages = queue.Queue(maxsize=queue_size)
+        self.dead = queue.Queue()
+        self.connections = []
+        self.timeout = None
+        self.closing = False
+        self.reconnects = 0
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.rotate_after = rotate_after
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.failures = 0
+        self.next_heartbeat = 0.0
+        self.rotations = 0
+        # (products, time of the last message before the connection died)
+        self.outages = []
+        self.gaps = []
+
+    def _chunks(self, product_ids):
+        for i in range(0, len(product_ids), self.max_per_connection):
+            yield product_ids[i:i + self.max_per_connection]
+
+    def _open(self, product_ids, delay=0.0):
+        connection = FeedConnection(self, product_ids, delay)
+        self.connections.append(connection)
+        connection.start()
+        return connection
+
+    def _backoff(self):
+        # Full jitter, so many connections dropped together do not retry together
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** self.failures))
+        self.failures += 1
+        return delay
+
+    def start(self):
+        for chunk in self._chunks(self.product_ids):
+            self._open(chunk)
+        return self
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def recv(self):
+        self.rebalance()
+        self.maintain()
+        try:
+            return self.messages.get(timeout=self.timeout)
+        except queue.Empty:
+            raise WebSocketTimeoutException("No message within {}s".format(self.timeout))
+
+    def recv_many(self, max_messages, max_wait=0.0):
+        """Up to max_messages, waiting like recv() for the first.
+
+        If fewer are queued after the first, sleeps max_wait seconds once
+        to let more arrive, so callers that pay per call (rather than per
+        message) get bigger batches for one wakeup.
+        """
+        messages = [self.recv()]
+        if max_wait and self.messages.qsize() < max_messages - 1:
+            time.sleep(max_wait)
+        get = self.messages.get_nowait
+        try:
+            while len(messages) < max_messages:
+                messages.append(get())
+        except queue.Empty:
+            pass
+        return messages
+
+    def rebalance(self):
+        orphaned = []
+        while not self.dead.empty():
+            connection = self.dead.get_nowait()
+            if connection in self.connections and not self.closing:
+                print("Connection for {} products died: {!r}".format(len(connection.product_ids), connection.error))
+                self.connections.remove(connection)
+                if connection.predecessor is not None:
+                    # A replacement that never took over; the old one still carries its products
+                    connection.predecessor.successor = None
+                    continue
+                self._outage(connection)
+                orphaned.extend(connection.product_ids)
+        if not orphaned:
+            return
+
+        self.reconnects += 1
+        for connection in self.connections:
+            room = self.max_per_connection - len(connection.product_ids)
+            if room <= 0 or connection.ws is None or connection.successor is not None or not orphaned:
+                continue
+            moved, orphaned = orphaned[:room], orphaned[room:]
+            try:
+                connection.add_products(moved)
+            except Exception:
+                orphaned.extend(moved)
+        for chunk in self._chunks(orphaned):
+            self._open(chunk, self._backoff())
+
+    def _outage(self, connection):
+        # A replacement that failed before receiving anything is part of
+        # the outage already recorded for its products
+        if connection.first_message is None and any(connection.product_ids[0] in products
+                                                    for products, _ in self.outages):
+            return
+        self.outages.append((frozenset(connection.product_ids), connection.last_message or connection.created))
+
+    def resubscribe(self, product_id):
+        for connection in self.connections:
+            if product_id in connection.product_ids and connection.ws is not None:
+                print("Resubscribing {}".format(product_id))
+                try:
+                    connection.resubscribe([product_id])
+                except Exception as e:
+                    # The dead connection is picked up by rebalance()
+                    connection.error = e
+                return
+
+    def observe(self, product_id, now=None):
+        """Note a ticker for product_id, closing any outage it ends."""
+        if not self.outages:
+            return
+        now = time.time() if now is None else now
+        ended = [outage for outage in self.outages if product_id in outage[0]]
+        for outage in ended:
+            self.outages.remove(outage)
+            gap = now - outage[1]
+            self.gaps.append(gap)
+            print("Feed for {} products resumed after a {:.3f}s gap".format(len(outage[0]), gap))
+        if ended:
+            self.failures = 0
+
+    def maintain(self):
+        """Send heartbeats and rotate old connections; called from recv()."""
+        now = time.time()
+        if self.heartbeat_interval and now >= self.next_heartbeat:
+            self.next_heartbeat = now + self.heartbeat_interval
+            for connection in self.connections:
+                connection.heartbeat(now, self.stale_after)
+        if not self.rotate_after:
+            return
+        for connection in list(self.connections):
+            successor = connection.successor
+            if successor is None:
+                if connection.predecessor is None and connection.connected is not None \
+                        and now - connection.connected >= self.rotate_after:
+                    # Backed off like a reconnect, so a successor that keeps
+                    # dying before its first message is not reopened at once
+                    connection.successor = self._open(connection.product_ids, self._backoff())
+                    connection.successor.predecessor = connection
+            elif successor.first_message is not None:
+                # The replacement is live, so the old socket can go
+                connection.retired = True
+                self.connections.remove(connection)
+                connection.close()
+                successor.predecessor = None
+                self.rotations += 1
+                self.failures = 0
+
+    @property
+    def stats(self):
+        return {
+            "connections": len(self.connections),
+            "reconnects": self.reconnects,
+            "rotations": self.rotations,
+            "gaps": len(self.gaps),
+            "max_gap_seconds": round(max(self.gaps), 3) if self.gaps else 0.0,
+            "mean_gap_seconds": round(sum(self.gaps) / len(self.gaps), 3) if self.gaps else 0.0,
+        }
+
+    def close(self):
+        self.closing = True
+        for connection in self.connections:
+            connection.close()
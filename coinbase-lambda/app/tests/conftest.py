@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The lambda modules import each other by plain name, as in the function package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
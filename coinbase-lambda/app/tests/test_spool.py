@@ -0,0 +1,86 @@
+from spool import FRAME, Spool, SpoolReplayer
+
+
+def records(start, stop):
+    return [{"Data": "message {}".format(i).encode("utf-8"), "PartitionKey": "key-{}".format(i % 3)}
+            for i in range(start, stop)]
+
+
+class FlakySend:
+    """Accepts up to `accept` records per call, then everything once healed."""
+
+    def __init__(self, accept):
+        self.accept = accept
+        self.sent = []
+
+    def __call__(self, batch):
+        accepted = len(batch) if self.accept is None else min(self.accept, len(batch))
+        self.sent.extend(batch[:accepted])
+        return accepted
+
+
+def test_replay_keeps_arrival_order(tmp_path):
+    spool = Spool(str(tmp_path / "spool"))
+    spool.append(records(0, 5), arrived=100.0)
+    spool.append(records(5, 12), arrived=101.0)
+    send = FlakySend(accept=3)
+    replayer = SpoolReplayer(spool, send, batch_size=4, base_delay=0.0)
+
+    replayer.drain()
+    # The first batch was partly rejected: the rest waits for the next attempt
+    assert [r["Data"] for r in send.sent] == [r["Data"] for r in records(0, 3)]
+    assert spool.records == 9
+    assert spool.oldest == 100.0
+    assert replayer.stats == {"replayed": 3, "replay_failures": 1}
+
+    send.accept = None
+    replayer.drain()
+    assert send.sent == records(0, 12)
+    assert not spool.pending()
+    assert spool.stats["spooled_bytes"] == 0
+
+
+def test_failed_send_keeps_records(tmp_path):
+    spool = Spool(str(tmp_path / "spool"))
+    spool.append(records(0, 3))
+
+    def send(batch):
+        raise RuntimeError("throttled")
+
+    replayer = SpoolReplayer(spool, send, base_delay=10.0)
+    replayer.drain()
+    assert spool.records == 3
+    # Backing off: nothing is attempted until next_attempt
+    replayer.send = FlakySend(accept=None)
+    replayer.drain()
+    assert spool.records == 3
+    assert replayer.delay == 20.0
+
+
+def test_reopen_resumes_after_acked_records(tmp_path):
+    path = str(tmp_path / "spool")
+    spool = Spool(path)
+    spool.append(records(0, 6))
+    batch = spool.peek(4)
+    spool.ack(4, batch[-1][1])
+    spool.close()
+
+    # A new process picks up at the saved offset
+    spool = Spool(path)
+    assert spool.records == 2
+    assert [record for record, _ in spool.peek(10)] == records(4, 6)
+
+
+def test_reopen_drops_torn_frame(tmp_path):
+    path = str(tmp_path / "spool")
+    spool = Spool(path)
+    spool.append(records(0, 3))
+    spool.close()
+    # A crash in the middle of an append leaves a partial frame behind
+    with open(path, "ab") as f:
+        f.write(FRAME.pack(0.0, 5, 100) + b"key-0" + b"partial")
+
+    spool = Spool(path)
+    assert spool.records == 3
+    spool.append(records(3, 4))
+    assert [record for record, _ in spool.peek(10)] == records(0, 4)
@@ -0,0 +1,85 @@
+import json
+import time
+from collections import namedtuple
+
+from product_table import ProductTable
+
+try:
+    import orjson
+    loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    loads = json.loads
+    JSON_BACKEND = "json"
+
+
+def _float(value):
+    return float(value) if value is not None else float("nan")
+
+
+class Ticker(namedtuple("Ticker", [
+    "product_id", "sequence", "price", "best_bid", "best_ask", "last_size", "time", "raw", "pid",
+], defaults=(-1,))):
+    """One Coinbase ticker message, decoded once.
+
+    raw keeps the original message so it can be published unchanged; pid
+    is the product's interned id, -1 when not interned.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_message(cls, fields, raw, pid=-1):
+        return cls(
+            fields["product_id"],
+            int(fields.get("sequence", -1)),
+            _float(fields.get("price")),
+            _float(fields.get("best_bid")),
+            _float(fields.get("best_ask")),
+            _float(fields.get("last_size")),
+            fields.get("time"),
+            raw,
+            pid,
+        )
+
+
+class TickerDecoder:
+    """Decodes websocket messages into Tickers and tracks throughput.
+
+    Product symbols are interned in products, so later stages can index
+    arrays by Ticker.pid instead of hashing the symbol again.
+    """
+
+    def __init__(self, products=None):
+        self.products = products if products is not None else ProductTable()
+        self.messages = 0
+        self.tickers = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def decode(self, message):
+        # Returns None for anything that is not a ticker
+        started = time.perf_counter()
+        self.messages += 1
+        try:
+            fields = loads(message)
+            if fields.get("type") != "ticker":
+                return None
+            ticker = Ticker.from_message(fields, message, self.products.intern(fields["product_id"]))
+        except (ValueError, KeyError, TypeError):
+            self.errors += 1
+            return None
+        finally:
+            self.seconds += time.perf_counter() - started
+        self.tickers += 1
+        return ticker
+
+    def report(self):
+        return {
+            "backend": JSON_BACKEND,
+            "messages": self.messages,
+            "tickers": self.tickers,
+            "errors": self.errors,
+            "decode_seconds": round(self.seconds, 6),
+            "messages_per_second": round(self.messages / self.seconds) if self.seconds else 0,
+        }